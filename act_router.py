@@ -0,0 +1,134 @@
+# act_router.py
+
+import logging
+import re
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from utils import normalize_act_name
+
+logger = logging.getLogger(__name__)
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+MONTH = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?'
+DAY = r'(\d{1,2})(?:st|nd|rd|th)?'
+
+# Most specific first, each match is blanked out before the next pattern runs
+ISO_DATE_PATTERN = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+NUMERIC_DATE_PATTERN = re.compile(r'\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b')  # day first, as written in India
+DAY_MONTH_YEAR_PATTERN = re.compile(rf'\b{DAY}\s+(?:of\s+)?{MONTH}\s*,?\s*(\d{{4}})\b', re.IGNORECASE)
+MONTH_DAY_YEAR_PATTERN = re.compile(rf'\b{MONTH}\s+{DAY}\s*,?\s*(\d{{4}})\b', re.IGNORECASE)
+MONTH_YEAR_PATTERN = re.compile(rf'\b{MONTH}\s*,?\s*(\d{{4}})\b', re.IGNORECASE)
+YEAR_PATTERN = re.compile(r'\b(1[89]\d{2}|20\d{2})\b')
+# Years that name a statute or numbers that cite a section are not dates of facts
+STATUTE_WORDS = ["act", "sanhita", "code", "adhiniyam", "ipc", "crpc"]
+SECTION_NUMBER_PATTERN = re.compile(r'\b(?:sections?|secs?\.?|ss?\.)\s*\d+', re.IGNORECASE)
+
+Period = Tuple[date, date]
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    return date.fromisoformat(str(value)) if value else None
+
+def _month_period(year: int, month: int) -> Period:
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return date(year, month, 1), next_month - timedelta(days=1)
+
+class Act:
+    def __init__(self, act_id: str, name: str, collection: str, citation: Optional[str] = None,
+                 files: Optional[List[str]] = None, keywords: Optional[List[str]] = None,
+                 in_force_from: Optional[str] = None, in_force_until: Optional[str] = None, default: bool = False):
+        """A statute indexed into its own collection"""
+        self.act_id = act_id
+        self.name = name
+        self.collection = collection
+        self.citation = citation or name
+        self.files = list(files or [])
+        self.in_force_from = _parse_date(in_force_from)
+        self.in_force_until = _parse_date(in_force_until)
+        self.default = default
+        # Names a section citation may qualify its number with, as in "section 185 of the Companies Act"
+        self.citation_names = {normalize_act_name(term) for term in (act_id, name, self.citation)} - {None}
+        # Keywords match at the start of a word, so "punish" also matches "punishment"
+        terms = [self.name, self.citation] + list(keywords or [])
+        self.topic_pattern = re.compile(
+            r'\b(?:' + '|'.join(re.escape(term.lower()) for term in terms if term) + ')', re.IGNORECASE
+        )
+
+    def in_force_during(self, period: Period) -> bool:
+        start, end = period
+        return (self.in_force_from is None or self.in_force_from <= end) and \
+            (self.in_force_until is None or self.in_force_until >= start)
+
+    def matches_topic(self, text: str) -> bool:
+        return self.topic_pattern.search(text) is not None
+
+    def __repr__(self) -> str:
+        return f"Act({self.act_id!r}, collection={self.collection!r})"
+
+def load_acts(config: Dict) -> List[Act]:
+    """Read the Act registry, defaulting to the single BNS collection"""
+    acts_config = config.get('acts') or {
+        'bns': {'name': "Bharatiya Nyaya Sanhita, 2023", 'citation': "BNS", 'collection': "bns_sections", 'default': True}
+    }
+    return [Act(act_id, **act_config) for act_id, act_config in acts_config.items()]
+
+class ActRouter:
+    def __init__(self, acts: List[Act]):
+        """Pick the Acts a query should be searched in from the topics and dates it mentions"""
+        if not acts:
+            raise ValueError("Act registry is empty")
+        self.acts = acts
+        self.default_acts = [act for act in acts if act.default] or list(acts)
+        statute_words = STATUTE_WORDS + [act.citation.lower() for act in acts]
+        self.statute_year_pattern = re.compile(
+            r'\b(?:' + '|'.join(re.escape(word) for word in statute_words) + r')\s*,?\s*(?:of\s+)?\d{4}\b', re.IGNORECASE
+        )
+    
+    def act_for_citation(self, act_name: str) -> Optional[Act]:
+        """The registered Act a normalized citation qualifier names, or None for Acts that are not indexed"""
+        for act in self.acts:
+            # The qualifier may start with words before the name, as in "what does the companies act"
+            if any(act_name == name or act_name.endswith(" " + name) for name in act.citation_names):
+                return act
+        return None
+    
+    def detect_periods(self, text: str) -> List[Period]:
+        """Dates, months and years mentioned in the text, each as a (first day, last day) period"""
+        text = SECTION_NUMBER_PATTERN.sub(' ', self.statute_year_pattern.sub(' ', text))
+        periods = []
+
+        def collect(pattern: re.Pattern, to_period) -> None:
+            nonlocal text
+            for match in pattern.finditer(text):
+                try:
+                    periods.append(to_period(match.groups()))
+                except (ValueError, KeyError):
+                    continue
+            text = pattern.sub(' ', text)
+
+        def single_day(day: date) -> Period:
+            return day, day
+
+        collect(ISO_DATE_PATTERN, lambda g: single_day(date(int(g[0]), int(g[1]), int(g[2]))))
+        collect(NUMERIC_DATE_PATTERN, lambda g: single_day(date(int(g[2]), int(g[1]), int(g[0]))))
+        collect(DAY_MONTH_YEAR_PATTERN, lambda g: single_day(date(int(g[2]), MONTHS[g[1].lower()[:3]], int(g[0]))))
+        collect(MONTH_DAY_YEAR_PATTERN, lambda g: single_day(date(int(g[2]), MONTHS[g[0].lower()[:3]], int(g[1]))))
+        collect(MONTH_YEAR_PATTERN, lambda g: _month_period(int(g[1]), MONTHS[g[0].lower()[:3]]))
+        collect(YEAR_PATTERN, lambda g: (date(int(g[0]), 1, 1), date(int(g[0]), 12, 31)))
+        return periods
+
+    def route(self, query: str, today: Optional[date] = None) -> List[Act]:
+        """Acts whose topics the query mentions, or the defaults, narrowed to those in force on the dates it mentions"""
+        candidates = [act for act in self.acts if act.matches_topic(query)] or self.default_acts
+
+        # Undated facts are governed by the Acts in force today
+        periods = self.detect_periods(query) or [(today or date.today(),) * 2]
+        acts = [act for act in candidates if any(act.in_force_during(period) for period in periods)]
+        if not acts:
+            logger.info(f"No registered Act in force on {[str(start) for start, _ in periods]}, searching all candidates")
+            acts = candidates
+
+        logger.info(f"Routed query to {[act.act_id for act in acts]}")
+        return acts
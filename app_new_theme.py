@@ -86,10 +86,16 @@ def create_interface():
         
         state = gr.State({"session_id": datetime.now().strftime('%Y%m%d_%H%M%S'), "messages": []})
         
-        txt.submit(assistant.process_query, [txt, chatbot, state], [txt, chatbot, state])
+        txt.submit(assistant.aprocess_query_stream, [txt, chatbot, state], [txt, chatbot, state])
         clear_btn.click(clear_chat, None, [txt, chatbot, state])
         download_btn.click(download_chat, inputs=[chatbot], outputs=[gr.File()])
     
+    concurrency_config = assistant.config.get('concurrency', {})
+    demo.queue(
+        default_concurrency_limit=concurrency_config.get('gradio_concurrency_limit', 16),
+        max_size=concurrency_config.get('gradio_max_queue_size', 100)
+    )
+    
     return demo
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+# benchmark_vector_store.py
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import argparse
+import logging
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+import numpy as np
+from config_loader import load_config, get_encoder
+from text_processor import TextProcessor
+from vector_store import BaseVectorStore, VectorStore
+from numpy_vector_store import NumpyVectorStore
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class MemoizedEncoder:
+    """Caches query embeddings so timed runs measure the index rather than the encoder"""
+    def __init__(self, handler):
+        self.handler = handler
+        self.cache: Dict[str, np.ndarray] = {}
+    
+    def encode(self, texts: List[str], batch_size: int = 32, workers: int = 1) -> np.ndarray:
+        missing = [text for text in dict.fromkeys(texts) if text not in self.cache]
+        if missing:
+            self.cache.update(zip(missing, self.handler.encode(missing, batch_size, workers)))
+        return np.stack([self.cache[text] for text in texts])
+    
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def time_calls(fn: Callable, args: List, repeat: int) -> List[float]:
+    """Latency of each call in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        for arg in args:
+            start = time.perf_counter()
+            fn(arg)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def run_benchmark(config_path: str, pdf_path: str, num_queries: int, batch_size: int, k: int, repeat: int) -> None:
+    config = load_config(config_path)
+    encoder = MemoizedEncoder(get_encoder(config))
+    text_processor = TextProcessor(pdf_workers=config.get('ingestion', {}).get('pdf_workers', 1))
+    sections = list(text_processor.iter_sections(text_processor.iter_pdf_pages(pdf_path)))
+    print(f"{len(sections)} sections from {pdf_path}")
+
+    # Section titles make realistic short queries
+    rng = random.Random(0)
+    queries = [section['title'] for section in rng.sample(sections, min(num_queries, len(sections)))]
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+    encoder.get_embeddings(queries)
+
+    backends = {
+        'chroma': lambda path: VectorStore(path, config['vector_db']['distance_strategy'], encoder),
+        'numpy-float32': lambda path: NumpyVectorStore(path, config['vector_db']['distance_strategy'], encoder, dtype='float32'),
+        'numpy-float16': lambda path: NumpyVectorStore(path, config['vector_db']['distance_strategy'], encoder, dtype='float16')
+    }
+
+    top_hits = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, factory in backends.items():
+            path = os.path.join(tmp_dir, name)
+            store: BaseVectorStore = factory(path)
+            start = time.perf_counter()
+            store.add_documents("benchmark", sections)
+            ingest_s = time.perf_counter() - start
+
+            # A fresh instance measures loading the persisted index and its first query
+            start = time.perf_counter()
+            store = factory(path)
+            store.search("benchmark", queries[0], k=k, score_threshold=0)
+            startup_ms = (time.perf_counter() - start) * 1000
+
+            single = time_calls(lambda query: store.search("benchmark", query, k=k, score_threshold=0), queries, repeat)
+            batched = time_calls(lambda batch: store.search_many("benchmark", batch, k=k, score_threshold=0), batches, repeat)
+            top_hits[name] = [
+                [result['metadata']['section_num'] for result in store.search("benchmark", query, k=k, score_threshold=0)]
+                for query in queries
+            ]
+
+            print(f"\n{name}")
+            print(f"  ingest: {ingest_s:.2f} s, startup + first query: {startup_ms:.1f} ms")
+            print(f"  single query: mean {statistics.mean(single):.2f} ms, p50 {percentile(single, 50):.2f} ms, p95 {percentile(single, 95):.2f} ms")
+            print(f"  batch of {batch_size}: mean {statistics.mean(batched):.2f} ms, p95 {percentile(batched, 95):.2f} ms")
+
+    # Exact search should return the same sections as Chroma's approximate index
+    for name in backends:
+        if name == 'chroma':
+            continue
+        overlap = [
+            len(set(ours) & set(theirs)) / max(len(theirs), 1)
+            for ours, theirs in zip(top_hits[name], top_hits['chroma'])
+        ]
+        print(f"\ntop-{k} agreement {name} vs chroma: {statistics.mean(overlap):.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare query latency of the Chroma and NumPy vector store backends")
+    parser.add_argument("pdf_path", nargs="?", help="PDF to index (defaults to the first PDF in ingestion.input_directory)")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--queries", type=int, default=200, help="number of queries")
+    parser.add_argument("--batch-size", type=int, default=6, help="queries per search_many call")
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the queries")
+    args = parser.parse_args()
+
+    pdf_path = args.pdf_path
+    if pdf_path is None:
+        input_directory = Path(load_config(args.config).get('ingestion', {}).get('input_directory', 'Input'))
+        pdf_path = str(next(p for p in sorted(input_directory.iterdir()) if p.suffix.lower() == '.pdf'))
+    run_benchmark(args.config, pdf_path, args.queries, args.batch_size, args.k, args.repeat)
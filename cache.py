@@ -0,0 +1,297 @@
+# cache.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    """Open a SQLite database shared across threads"""
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return sqlite3.connect(db_path, check_same_thread=False)
+
+class CacheStats:
+    def __init__(self):
+        """Hit/miss counters for a cache"""
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hit_rate, 4)}
+
+class LRUCache:
+    def __init__(self, max_entries: int = 1000, persist_path: Optional[str] = None, table: str = "entries"):
+        """Bounded LRU cache of JSON-serializable values with optional SQLite persistence"""
+        self.max_entries = max_entries
+        self.table = table
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if persist_path:
+            self._db = _connect(persist_path)
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, last_used REAL)"
+            )
+            self._db.commit()
+            rows = self._db.execute(
+                f"SELECT key, value FROM {table} ORDER BY last_used DESC LIMIT ?", (max_entries,)
+            ).fetchall()
+            for key, value in reversed(rows):
+                self._entries[key] = json.loads(value)
+            logger.info(f"Loaded {len(self._entries)} cached entries from {table}")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a cached value, marking it as recently used"""
+        with self._lock:
+            hit = key in self._entries
+            self.stats.record(hit)
+            if not hit:
+                return None
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+            return self._entries[key]
+
+    def put(self, key: str, value: Any) -> None:
+        """Store a value, evicting the least recently used entries beyond the size cap"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                evicted.append((evicted_key,))
+            if self._db is not None:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time())
+                )
+                self._db.executemany(f"DELETE FROM {self.table} WHERE key = ?", evicted)
+                self._db.commit()
+
+class SemanticResponseCache:
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 86400,
+                 distance_threshold: float = 0.05, persist_path: Optional[str] = None):
+        """Cache LLM answers keyed on query embedding plus the retrieved sections"""
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.distance_threshold = distance_threshold
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if persist_path:
+            self._db = _connect(persist_path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, sections TEXT, embedding BLOB, response TEXT, created REAL)"
+            )
+            self._db.commit()
+            self._load()
+
+    @staticmethod
+    def _sections_key(sections: Iterable[str], variant: str = "") -> str:
+        key = ",".join(sorted(str(s) for s in sections))
+        return f"{key}|{variant}" if variant else key
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _is_expired(self, entry: Dict, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - entry["created"] > self.ttl_seconds
+
+    def _load(self) -> None:
+        """Load persisted entries, oldest first so LRU order is preserved"""
+        now = time.time()
+        rows = self._db.execute(
+            "SELECT key, sections, embedding, response, created FROM responses ORDER BY created"
+        ).fetchall()
+        for key, sections, embedding, response, created in rows:
+            entry = {
+                "sections": sections,
+                "embedding": np.frombuffer(embedding, dtype=np.float32),
+                "response": response,
+                "created": created
+            }
+            if not self._is_expired(entry, now):
+                self._entries[key] = entry
+        self._evict()
+        logger.info(f"Loaded {len(self._entries)} cached responses")
+
+    def _delete(self, keys: List[str]) -> None:
+        if self._db is not None and keys:
+            self._db.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in keys])
+            self._db.commit()
+
+    def _evict(self) -> None:
+        """Drop the least recently used entries beyond the size cap"""
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            evicted.append(key)
+        self._delete(evicted)
+
+    def lookup(self, embedding, sections: Iterable[str], variant: str = "") -> Optional[str]:
+        """Return a cached response for a similar query that retrieved the same sections"""
+        sections_key = self._sections_key(sections, variant)
+        query_vector = self._normalize(embedding)
+        now = time.time()
+
+        with self._lock:
+            expired = []
+            best_key, best_distance = None, None
+            for key, entry in self._entries.items():
+                if self._is_expired(entry, now):
+                    expired.append(key)
+                    continue
+                if entry["sections"] != sections_key:
+                    continue
+                distance = 1.0 - float(np.dot(query_vector, entry["embedding"]))
+                if distance <= self.distance_threshold and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = key, distance
+
+            for key in expired:
+                del self._entries[key]
+            self._delete(expired)
+
+            self.stats.record(best_key is not None)
+            if best_key is None:
+                return None
+
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key]["response"]
+
+    def store(self, query: str, embedding, sections: Iterable[str], response: str, variant: str = "") -> None:
+        """Store a response for a query and its retrieved sections"""
+        sections_key = self._sections_key(sections, variant)
+        key = hashlib.sha256(f"{query.strip().lower()}|{sections_key}".encode("utf-8")).hexdigest()
+        entry = {
+            "sections": sections_key,
+            "embedding": self._normalize(embedding),
+            "response": response,
+            "created": time.time()
+        }
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, sections_key, entry["embedding"].tobytes(), response, entry["created"])
+                )
+                self._db.commit()
+            self._evict()
+
+class EmbeddingCache:
+    def __init__(self, persist_path: str, max_entries: int = 200000, memory_entries: int = 10000):
+        """Content-addressed embeddings in SQLite, keyed on model plus text hash, with a small in-memory LRU in front"""
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.stats = CacheStats()
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = _connect(persist_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"Embedding cache has {self._count} vectors")
+
+    @staticmethod
+    def key(model: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors for texts, None where missing"""
+        keys = [self.key(model, text) for text in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(keys)
+        with self._lock:
+            on_disk = []
+            for idx, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    vectors[idx] = self._memory[key]
+                else:
+                    on_disk.append(idx)
+
+            # SQLite limits bound parameters, so look keys up in chunks
+            found = {}
+            for start in range(0, len(on_disk), 500):
+                chunk = list({keys[idx] for idx in on_disk[start:start + 500]})
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._db.commit()
+            for idx in on_disk:
+                vector = found.get(keys[idx])
+                if vector is not None:
+                    vectors[idx] = vector
+                    self._remember(keys[idx], vector)
+
+            for vector in vectors:
+                self.stats.record(vector is not None)
+        return vectors
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray) -> None:
+        """Store vectors, evicting the least recently used beyond the size cap"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, np.asarray(vectors, dtype=np.float32)):
+                key = self.key(model, text)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+            before = self._db.total_changes
+            self._db.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._count += self._db.total_changes - before
+            if self._count > self.max_entries:
+                excess = self._count - self.max_entries
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+                self._count -= excess
+                logger.info(f"Evicted {excess} vectors from the embedding cache")
+            self._db.commit()
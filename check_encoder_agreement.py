@@ -0,0 +1,81 @@
+# check_encoder_agreement.py
+import os
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from config_loader import load_config
+from embeddings_handler import EmbeddingsHandler
+from text_processor import TextProcessor
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def encode_timed(handler: EmbeddingsHandler, texts: list) -> tuple:
+    start = time.perf_counter()
+    embeddings = handler.encode(texts)
+    return embeddings, time.perf_counter() - start
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+def check_agreement(config_path: str, pdf_path: str, min_cosine: float, k: int) -> bool:
+    """Compare the int8 ONNX encoder with the fp32 PyTorch model on a corpus's sections and titles"""
+    config = load_config(config_path)
+    encoder_config = config['encoder']
+    text_processor = TextProcessor()
+    sections = list(text_processor.iter_sections(text_processor.iter_pdf_pages(pdf_path)))
+    documents = [section['content'] for section in sections]
+    queries = [section['title'] for section in sections]
+
+    reference = EmbeddingsHandler(encoder_config['model_name'], 'cpu', backend='torch',
+                                  num_threads=encoder_config.get('num_threads', 0))
+    quantized = EmbeddingsHandler(encoder_config['model_name'], 'cpu', backend='onnx',
+                                  num_threads=encoder_config.get('num_threads', 0),
+                                  onnx_cache_dir=encoder_config.get('onnx_cache_dir', 'models/onnx'))
+    reference.warmup()
+    quantized.warmup()
+
+    ref_docs, ref_doc_s = encode_timed(reference, documents)
+    onnx_docs, onnx_doc_s = encode_timed(quantized, documents)
+    ref_queries, ref_query_s = encode_timed(reference, queries)
+    onnx_queries, onnx_query_s = encode_timed(quantized, queries)
+
+    cosines = np.concatenate([
+        (normalize(ref_docs) * normalize(onnx_docs)).sum(axis=1),
+        (normalize(ref_queries) * normalize(onnx_queries)).sum(axis=1)
+    ])
+
+    # Retrieval agreement: top k sections for each title query under both encoders
+    ref_top = np.argsort(-(normalize(ref_queries) @ normalize(ref_docs).T), axis=1)[:, :k]
+    onnx_top = np.argsort(-(normalize(onnx_queries) @ normalize(onnx_docs).T), axis=1)[:, :k]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, onnx_top)])
+
+    print(f"{len(sections)} sections from {pdf_path}")
+    print(f"cosine fp32 vs int8: mean {cosines.mean():.4f}, min {cosines.min():.4f}, p1 {np.percentile(cosines, 1):.4f}")
+    print(f"top-{k} retrieval agreement: {overlap:.3f}")
+    print(f"sections: torch {ref_doc_s:.2f} s, onnx {onnx_doc_s:.2f} s")
+    print(f"titles: torch {ref_query_s * 1000 / len(queries):.2f} ms/query, onnx {onnx_query_s * 1000 / len(queries):.2f} ms/query")
+
+    passed = cosines.mean() >= min_cosine
+    if not passed:
+        logger.error(f"Mean cosine agreement {cosines.mean():.4f} is below {min_cosine}")
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the quantized ONNX encoder against the fp32 model")
+    parser.add_argument("pdf_path", nargs="?", help="PDF to encode (defaults to the first PDF in ingestion.input_directory)")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="fail if mean cosine agreement is lower")
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    pdf_path = args.pdf_path
+    if pdf_path is None:
+        input_directory = Path(load_config(args.config).get('ingestion', {}).get('input_directory', 'Input'))
+        pdf_path = str(next(p for p in sorted(input_directory.iterdir()) if p.suffix.lower() == '.pdf'))
+    sys.exit(0 if check_agreement(args.config, pdf_path, args.min_cosine, args.k) else 1)
@@ -0,0 +1,121 @@
+# check_llm_gateway.py
+import os
+import sys
+import time
+import asyncio
+import logging
+from langchain_core.messages import HumanMessage
+from config_loader import get_chat_model
+from llm_gateway import LLMGateway, LLMProvider, LLMUnavailableError, create_http_clients
+from llm_stub_server import StubBehaviour, start_stub_server
+
+# The stub ignores the key, the OpenAI client only needs one to be set
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+MESSAGES = [HumanMessage(content="What is the punishment for criminal intimidation?")]
+
+def make_gateway(behaviours, failure_threshold: int = 3, cooldown_seconds: float = 30, **options) -> LLMGateway:
+    """A gateway over one stub server per behaviour, in order, configured like get_llm does"""
+    http_clients = create_http_clients(timeout_seconds=10)
+    providers = []
+    for index, behaviour in enumerate(behaviours):
+        server = start_stub_server(behaviour, port=0)
+        model = get_chat_model("openai", {
+            "model_name": "stub",
+            "temperature": 0,
+            "max_tokens": 100,
+            "base_url": f"http://127.0.0.1:{server.server_address[1]}/v1"
+        }, http_clients, 10)
+        providers.append(LLMProvider(f"stub{index}", model, failure_threshold=failure_threshold,
+                                     cooldown_seconds=cooldown_seconds))
+    options.setdefault("backoff_base_seconds", 0.01)
+    return LLMGateway(providers=providers, **options)
+
+def answer(gateway: LLMGateway) -> str:
+    try:
+        return gateway.invoke(MESSAGES).content
+    except LLMUnavailableError:
+        return ""
+
+def timed(call) -> tuple:
+    start = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - start
+
+def check_retry_after() -> dict:
+    """429s wait at least Retry-After before retrying, and fail over when it is longer than the backoff cap"""
+    limited = StubBehaviour("primary", rate_limit_rate=1.0, retry_after=0.3)
+    gateway = make_gateway([limited], failure_threshold=10, max_retries=2)
+    reply, seconds = timed(lambda: answer(gateway))
+    retried = reply == "" and limited.requests == 3 and seconds >= 0.6
+
+    limited = StubBehaviour("primary", rate_limit_rate=1.0, retry_after=30)
+    fallback = StubBehaviour("secondary")
+    gateway = make_gateway([limited, fallback], backoff_max_seconds=8)
+    reply, seconds = timed(lambda: answer(gateway))
+    return {
+        "429 retried after Retry-After": retried,
+        "Retry-After over the backoff cap fails over": reply == "secondary" and limited.requests == 1 and seconds < 5
+    }
+
+def check_failover() -> dict:
+    """A provider answering 503s is retried, then the next provider answers, sync, async and streamed"""
+    failing = StubBehaviour("primary", error_rate=1.0)
+    fallback = StubBehaviour("secondary")
+    gateway = make_gateway([failing, fallback], failure_threshold=10, max_retries=1)
+    reply = answer(gateway)
+    requests = failing.requests
+    async_reply = asyncio.run(gateway.ainvoke(MESSAGES)).content
+    streamed = "".join(chunk.content for chunk in gateway.stream(MESSAGES)).strip()
+    return {
+        "503s fail over to the next provider": reply == "secondary" and requests == 2,
+        "async call fails over": async_reply == "secondary",
+        "stream fails over": streamed == "secondary",
+        "all providers failing raises LLMUnavailableError": answer(make_gateway([failing, failing])) == ""
+    }
+
+def check_cooldown() -> dict:
+    """Repeated failures take a provider out for the cooldown, after which one probe brings it back"""
+    failing = StubBehaviour("primary", error_rate=1.0)
+    fallback = StubBehaviour("secondary")
+    gateway = make_gateway([failing, fallback], failure_threshold=2, cooldown_seconds=0.5, max_retries=3)
+    first = answer(gateway)
+    opened = not gateway.health()["stub0"]["available"]
+    requests = failing.requests
+    skipped = answer(gateway) == "secondary" and failing.requests == requests
+
+    time.sleep(0.6)
+    failing.error_rate = 0.0
+    probed = answer(gateway) == "primary"
+    return {
+        "failing provider opens after the threshold": first == "secondary" and opened and requests == 2,
+        "open provider is skipped": skipped,
+        "provider is probed and recovers after the cooldown": probed and gateway.health()["stub0"]["available"]
+    }
+
+def check_hedging() -> dict:
+    """A slow provider is hedged with the next one, and the first answer wins"""
+    slow = StubBehaviour("primary", latency=2.0)
+    fast = StubBehaviour("secondary")
+    gateway = make_gateway([slow, fast], hedge_after_seconds=0.2)
+    reply, seconds = timed(lambda: answer(gateway))
+    async_reply, async_seconds = timed(lambda: asyncio.run(gateway.ainvoke(MESSAGES)).content)
+
+    unhedged = make_gateway([StubBehaviour("primary", latency=0.5), StubBehaviour("secondary")])
+    return {
+        "slow provider is hedged": reply == "secondary" and seconds < 1.5,
+        "async call is hedged": async_reply == "secondary" and async_seconds < 1.5,
+        "no hedge when disabled": answer(unhedged) == "primary"
+    }
+
+def check_gateway() -> bool:
+    checks = {}
+    for check in (check_retry_after, check_failover, check_cooldown, check_hedging):
+        checks.update(check())
+    for name, passed in checks.items():
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    return all(checks.values())
+
+if __name__ == "__main__":
+    # The gateway logs every retry and failover these checks provoke
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(0 if check_gateway() else 1)
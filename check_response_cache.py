@@ -0,0 +1,45 @@
+# check_response_cache.py
+import sys
+import numpy as np
+from cache import SemanticResponseCache
+from query_assistant import QueryAssistant
+
+QUERY = "please draft the petition"
+SECTIONS = ["BNS 318", "BNS 319"]
+HISTORY_A = (
+    "User: I represent Ramesh Kumar, who was cheated out of his savings by a fake investment scheme\n"
+    "Assistant: This falls under BNS Section 318 (cheating) ..."
+)
+HISTORY_B = (
+    "User: My client Priya Sharma paid a builder who never handed over the flat\n"
+    "Assistant: This may be cheating under BNS Section 318 ..."
+)
+
+def check_history_isolation() -> bool:
+    """An answer generated in one conversation must only be served to the same conversation"""
+    cache = SemanticResponseCache(max_entries=10)
+    embedding = np.ones(16, dtype=np.float32)
+    cache.store(QUERY, embedding, SECTIONS, "PETITION on behalf of Ramesh Kumar ...",
+                QueryAssistant._cache_variant(None, HISTORY_A))
+    # Written before the conversation was part of the key
+    cache.store(QUERY, embedding, ["BNS 1"], "PETITION on behalf of Ramesh Kumar ...")
+
+    def served(conv_context: str, languages=None) -> bool:
+        return cache.lookup(embedding, SECTIONS, QueryAssistant._cache_variant(languages, conv_context)) is not None
+
+    checks = {
+        "same conversation reuses the answer": served(HISTORY_A),
+        "same conversation, different whitespace and case": served("  " + HISTORY_A.upper().replace(" ", "  ")),
+        "other conversation does not": not served(HISTORY_B),
+        "new conversation does not": not served(""),
+        "pipeline mode does not": not served(HISTORY_A, ["Tamil"]),
+        "entry without a history key is ignored": cache.lookup(
+            embedding, ["BNS 1"], QueryAssistant._cache_variant(None, "")
+        ) is None
+    }
+    for name, passed in checks.items():
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    return all(checks.values())
+
+if __name__ == "__main__":
+    sys.exit(0 if check_history_isolation() else 1)
@@ -1,38 +1,218 @@
 import os
+import logging
 import yaml  # Added this import
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_groq import ChatGroq
-from langchain_huggingface import HuggingFaceEmbeddings
+from embeddings_handler import get_embeddings_handler
+from cache import EmbeddingCache, LRUCache, SemanticResponseCache
+from phrase_extractor import LocalPhraseExtractor
+from context_builder import ContextBuilder, load_tokenizer
+from act_router import ActRouter, load_acts
+from reranker import CrossEncoderReranker
+from metrics import set_trace_log, start_metrics_server
+from llm_gateway import LLMGateway, LLMProvider, create_http_clients
+from vector_store import VectorStore
+from numpy_vector_store import NumpyVectorStore
+from index_bundle import BUNDLE_FILE, StaleBundleError, ingest_manifest_path, verify_bundle
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 def load_config():
     with open("config.yaml", "r") as f:
         return yaml.safe_load(f)
 
-def get_llm(config):
-    provider = config["llm"]["provider"]
+def get_chat_model(provider, model_config, http_clients=None, timeout=None):
+    options = {
+        "model_name": model_config["model_name"],
+        "temperature": model_config["temperature"],
+        "max_tokens": model_config["max_tokens"]
+    }
+    if model_config.get("base_url"):
+        options["base_url"] = model_config["base_url"]
+    if http_clients is not None:
+        # The gateway owns retries, so the provider clients make a single attempt
+        options.update(http_client=http_clients[0], http_async_client=http_clients[1], max_retries=0, timeout=timeout)
     
     if provider == "openai":
-        return ChatOpenAI(
-            model_name=config["llm"]["models"]["openai"]["model_name"],
-            temperature=config["llm"]["models"]["openai"]["temperature"],
-            max_tokens=config["llm"]["models"]["openai"]["max_tokens"]
-        )
+        return ChatOpenAI(**options)
     elif provider == "groq":
-        return ChatGroq(
-            model_name=config["llm"]["models"]["groq"]["model_name"],
-            temperature=config["llm"]["models"]["groq"]["temperature"],
-            max_tokens=config["llm"]["models"]["groq"]["max_tokens"]
-        )
-    else:
-        raise ValueError(f"Unsupported LLM provider: {provider}")
+        return ChatGroq(**options)
+    raise ValueError(f"Unsupported LLM provider: {provider}")
+
+def get_llm(config):
+    llm_config = config["llm"]
+    provider = llm_config["provider"]
+    gateway_config = llm_config.get("gateway", {})
+    if not gateway_config.get("enabled", False):
+        return get_chat_model(provider, llm_config["models"][provider])
+    
+    timeout = gateway_config.get("timeout_seconds", 60)
+    http_clients = create_http_clients(gateway_config.get("max_connections", 50), timeout)
+    fallback = llm_config.get("fallback")
+    if fallback is None:
+        fallback = list(llm_config["models"])
+    
+    providers = []
+    for name in [provider] + [name for name in fallback if name != provider]:
+        model_config = llm_config["models"][name]
+        try:
+            model = get_chat_model(name, model_config, http_clients, timeout)
+        except Exception as e:
+            # A fallback without credentials is left out rather than failing startup
+            if not providers:
+                raise
+            logger.warning(f"Fallback LLM provider {name} unavailable: {str(e)}")
+            continue
+        providers.append(LLMProvider(
+            name,
+            model,
+            requests_per_minute=model_config.get("requests_per_minute"),
+            tokens_per_minute=model_config.get("tokens_per_minute"),
+            failure_threshold=gateway_config.get("failure_threshold", 3),
+            cooldown_seconds=gateway_config.get("cooldown_seconds", 30)
+        ))
+    logger.info(f"LLM gateway providers: {[p.name for p in providers]}")
+    
+    return LLMGateway(
+        providers=providers,
+        max_retries=gateway_config.get("max_retries", 3),
+        backoff_base_seconds=gateway_config.get("backoff_base_seconds", 0.5),
+        backoff_max_seconds=gateway_config.get("backoff_max_seconds", 8),
+        max_queue_seconds=gateway_config.get("max_queue_seconds", 5),
+        hedge_after_seconds=gateway_config.get("hedge_after_seconds", 0)
+    )
 
 def get_encoder(config):
-    return HuggingFaceEmbeddings(
+    return get_embeddings_handler(
         model_name=config["encoder"]["model_name"],
-        model_kwargs={"device": config["encoder"]["device"]}
+        device=config["encoder"]["device"],
+        warmup=config["encoder"].get("warmup", True),
+        backend=config["encoder"].get("backend", "torch"),
+        num_threads=config["encoder"].get("num_threads", 0),
+        onnx_cache_dir=config["encoder"].get("onnx_cache_dir", "models/onnx"),
+        cache=get_embedding_cache(config)
+    )
+
+def get_embedding_cache(config):
+    cache_config = config.get("embedding_cache", {})
+    if not cache_config.get("enabled", False):
+        return None
+    return EmbeddingCache(
+        persist_path=cache_config.get("persist_path", "cache/embeddings.sqlite"),
+        max_entries=cache_config.get("max_entries", 200000),
+        memory_entries=cache_config.get("memory_entries", 10000)
+    )
+
+def get_vector_store(config, embeddings_handler, use_bundle=True):
+    db_config = config["vector_db"]
+    hybrid_config = config["retrieval"].get("hybrid", {})
+    ingestion_config = config.get("ingestion", {})
+    options = dict(
+        persist_directory=db_config["persist_directory"],
+        distance_strategy=db_config["distance_strategy"],
+        embeddings_handler=embeddings_handler,
+        index_mode=config["chunking"].get("index_mode", "section"),
+        chunks_per_section=config["chunking"].get("chunks_per_section", 2),
+        hybrid=hybrid_config.get("enabled", False),
+        rrf_k=hybrid_config.get("rrf_k", 60),
+        sparse_k=hybrid_config.get("sparse_k", 10),
+        embedding_batch_size=ingestion_config.get("embedding_batch_size", 32),
+        embedding_workers=ingestion_config.get("embedding_workers", 1)
+    )
+    
+    # A prebuilt index bundle is memory-mapped read-only in place of the live store
+    bundle_directory = db_config.get("bundle_directory")
+    if use_bundle and bundle_directory and os.path.exists(os.path.join(bundle_directory, BUNDLE_FILE)):
+        try:
+            manifest = verify_bundle(config, bundle_directory, options["embeddings_handler"],
+                                     db_config.get("verify_checksums", True))
+            logger.info(f"Using index bundle {bundle_directory}")
+            return NumpyVectorStore(dtype=manifest["dtype"], **{**options, "persist_directory": bundle_directory})
+        except StaleBundleError as e:
+            # A re-indexed live store is newer than the bundle, without one there is nothing better to serve
+            if not os.path.exists(ingest_manifest_path(config)):
+                raise
+            logger.warning(f"{e}, using the live vector store instead")
+    
+    store_type = db_config.get("type", "chroma")
+    if store_type == "chroma":
+        return VectorStore(**options)
+    elif store_type == "numpy":
+        return NumpyVectorStore(dtype=db_config.get("dtype", "float32"), **options)
+    else:
+        raise ValueError(f"Unsupported vector store type: {store_type}")
+
+def get_response_cache(config):
+    cache_config = config.get("response_cache", {})
+    if not cache_config.get("enabled", False):
+        return None
+    return SemanticResponseCache(
+        max_entries=cache_config.get("max_entries", 1000),
+        ttl_seconds=cache_config.get("ttl_seconds", 86400),
+        distance_threshold=cache_config.get("distance_threshold", 0.05),
+        persist_path=cache_config.get("persist_path") or None
+    )
+
+def get_phrase_cache(config):
+    cache_config = config.get("phrase_cache", {})
+    if not cache_config.get("enabled", False):
+        return None
+    return LRUCache(
+        max_entries=cache_config.get("max_entries", 5000),
+        persist_path=cache_config.get("persist_path") or None,
+        table="search_phrases"
+    )
+
+def get_context_builder(config, llm=None):
+    context_config = config.get("context", {})
+    # Only OpenAI's client counts with the model's own tokenizer (tiktoken), the others fall back to GPT-2's
+    use_provider_tokenizer = context_config.get("use_provider_tokenizer", True) and config["llm"]["provider"] == "openai"
+    return ContextBuilder(
+        llm=llm if use_provider_tokenizer else None,
+        max_tokens=context_config.get("max_tokens", 6000),
+        document_share=context_config.get("document_share", 0.75),
+        max_history_messages=context_config.get("max_history_messages", 6),
+        max_message_tokens=context_config.get("max_message_tokens", 400),
+        tokenizer=load_tokenizer(context_config.get("tokenizer", "")),
+        estimate_headroom=context_config.get("estimate_headroom", 0.15)
+    )
+
+def get_act_router(config):
+    return ActRouter(load_acts(config))
+
+def start_metrics(config):
+    metrics_config = config.get("metrics", {})
+    set_trace_log(metrics_config.get("trace_log") or None)
+    if not metrics_config.get("enabled", False):
+        return None
+    return start_metrics_server(metrics_config.get("host", "0.0.0.0"), metrics_config.get("port", 9100))
+
+def get_reranker(config):
+    rerank_config = config["retrieval"].get("rerank", {})
+    if not rerank_config.get("enabled", False):
+        return None
+    return CrossEncoderReranker(
+        model_name=rerank_config.get("model_name", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+        device=config["encoder"]["device"],
+        batch_size=rerank_config.get("batch_size", 16),
+        max_length=rerank_config.get("max_length", 512),
+        latency_budget_ms=rerank_config.get("latency_budget_ms", 300),
+        cache_size=rerank_config.get("cache_size", 10000),
+        warmup=config["encoder"].get("warmup", True),
+        reprobe_seconds=rerank_config.get("reprobe_seconds", 60)
+    )
+
+def get_local_phrase_extractor(config, vector_store, collection_name):
+    extraction_config = config.get("phrase_extraction", {})
+    if extraction_config.get("mode", "llm") != "local" and not extraction_config.get("fallback_to_local", False):
+        return None
+    return LocalPhraseExtractor(
+        sections=vector_store.get_all_metadata(collection_name),
+        embeddings_handler=vector_store.embeddings_handler if extraction_config.get("use_embeddings", True) else None,
+        max_phrases=extraction_config.get("max_phrases", 6)
     )
     
 
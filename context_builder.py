@@ -0,0 +1,139 @@
+# context_builder.py
+
+import logging
+import math
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Markdown headings that start a translation block in previous answers
+TRANSLATION_PATTERN = re.compile(r'\n\s*(?:-{3,}\s*\n\s*)?(?:#+|\*\*)[^\n]*translation', re.IGNORECASE)
+CHARS_PER_TOKEN = 4
+
+def load_tokenizer(name: str):
+    """Load the LLM's tokenizer from a tokenizer.json path or Hugging Face repo, or None if it is unavailable"""
+    if not name:
+        return None
+    try:
+        from tokenizers import Tokenizer
+        if os.path.exists(name):
+            return Tokenizer.from_file(name)
+        return Tokenizer.from_pretrained(name, token=os.getenv("HF_TOKEN"))
+    except Exception as e:
+        logger.warning(f"Could not load LLM tokenizer {name}, estimating token counts from length: {str(e)}")
+        return None
+
+class ContextBuilder:
+    def __init__(self, llm=None, max_tokens: int = 6000, document_share: float = 0.75,
+                 max_history_messages: int = 6, max_message_tokens: int = 400, tokenizer=None,
+                 estimate_headroom: float = 0.15):
+        """Assemble document and conversation context for the response prompt within a token budget"""
+        self.llm = llm
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.document_share = document_share
+        self.max_history_messages = max_history_messages
+        self.max_message_tokens = max_message_tokens
+        self.estimate_headroom = estimate_headroom
+        self._use_estimate = llm is None
+    
+    @property
+    def estimating(self) -> bool:
+        return self.tokenizer is None and self._use_estimate
+    
+    def count_tokens(self, text: str) -> int:
+        """Count tokens with the LLM's own tokenizer, or estimate from length if it is unavailable"""
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        if not self._use_estimate:
+            try:
+                tokens = self.llm.get_num_tokens(text)
+                # A tokenizer that failed to load can count nothing at all
+                if tokens > 0:
+                    return tokens
+                logger.warning("LLM tokenizer returned no tokens, estimating from length")
+            except Exception as e:
+                logger.warning(f"Token counting unavailable, estimating from length: {str(e)}")
+            self._use_estimate = True
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> Tuple[str, int]:
+        """Cut text at a word boundary so it fits max_tokens"""
+        tokens = self.count_tokens(text)
+        while tokens > max_tokens and text:
+            keep = int(len(text) * max_tokens / tokens * 0.95)
+            text = text[:keep].rsplit(' ', 1)[0] + " ..." if keep > 0 else ""
+            tokens = self.count_tokens(text)
+        return text, tokens
+
+    @staticmethod
+    def format_section(result: Dict) -> str:
+        return f"{result.get('citation', 'BNS')} Section {result['metadata']['section_num']}: {result['metadata']['title']}\n{result['content']}"
+
+    def build_history(self, messages: List[Dict], budget: int) -> Tuple[str, int, int]:
+        """Most recent turns first, with translations dropped and long answers cut, until the budget is used"""
+        lines = []
+        used = 0
+        for message in reversed(messages[-self.max_history_messages:]):
+            content = message['content']
+            if message['role'] == 'assistant':
+                content = TRANSLATION_PATTERN.split(content, maxsplit=1)[0].strip()
+            line, tokens = self.truncate(f"{message['role'].capitalize()}: {content}", self.max_message_tokens)
+            if used + tokens > budget:
+                break
+            lines.append(line)
+            used += tokens
+        return "\n".join(reversed(lines)), used, len(lines)
+
+    def build_documents(self, results: List[Dict], budget: int) -> Tuple[str, List[Dict], int]:
+        """Drop the lowest-scoring sections until the rest fit, truncating a lone section that is still too long"""
+        kept = list(results)
+        tokens = [self.count_tokens(self.format_section(result)) for result in kept]
+        # Sections are joined by a blank line, roughly one token each
+        while len(kept) > 1 and sum(tokens) + len(kept) > budget:
+            lowest = min(range(len(kept)), key=lambda idx: (kept[idx].get('score', 0), -idx))
+            del kept[lowest]
+            del tokens[lowest]
+
+        if kept and tokens[0] > budget:
+            header = self.format_section({**kept[0], 'content': ''})
+            content, _ = self.truncate(kept[0]['content'], max(budget - self.count_tokens(header), 0))
+            kept[0] = {**kept[0], 'content': content}
+            tokens[0] = self.count_tokens(self.format_section(kept[0]))
+
+        doc_context = "\n\n".join(self.format_section(result) for result in kept)
+        return doc_context, kept, sum(tokens)
+
+    def build(self, query: str, memory: Optional[Dict], results: List[Dict]) -> Tuple[Dict, List[Dict]]:
+        """Build the response chain inputs, returning them with the sections actually included"""
+        with metrics.stage("context"):
+            return self._build(query, memory, results)
+    
+    def _build(self, query: str, memory: Optional[Dict], results: List[Dict]) -> Tuple[Dict, List[Dict]]:
+        query_tokens = self.count_tokens(query)
+        # A length estimate can undercount the LLM's tokenizer, so part of the budget is kept free
+        max_tokens = int(self.max_tokens * (1 - self.estimate_headroom)) if self.estimating else self.max_tokens
+        budget = max(max_tokens - query_tokens, 0)
+
+        # History gets at most its share, documents get everything it leaves
+        history_budget = int(budget * (1 - self.document_share))
+        conv_context, history_tokens, history_messages = self.build_history((memory or {}).get("messages", []), history_budget)
+        document_budget = budget - history_tokens
+        doc_context, kept, document_tokens = self.build_documents(results, document_budget)
+
+        logger.info(
+            f"Context tokens: query {query_tokens}, documents {document_tokens}/{document_budget} "
+            f"({len(kept)}/{len(results)} sections), history {history_tokens}/{history_budget} ({history_messages} messages)"
+        )
+        metrics.record_tokens(query=query_tokens, documents=document_tokens, history=history_tokens)
+        return {
+            "query": query,
+            "conv_context": conv_context,
+            "doc_context": doc_context
+        }, kept
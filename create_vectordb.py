@@ -1,11 +1,19 @@
 # create_vectordb.py
 import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+import argparse
+import hashlib
+import json
 import logging
-from config_loader import load_config
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+from act_router import load_acts
+from config_loader import load_config, get_encoder, get_vector_store
+from index_bundle import export_bundle
 from text_processor import TextProcessor
-from vector_store import VectorStore
-from embeddings_handler import EmbeddingsHandler
+from vector_store import BaseVectorStore
+from sparse_index import BM25Index
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,45 +25,208 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def create_vector_database(config_path: str = "config.yaml", pdf_path: str = "./Input/a2023-45.pdf"):
-    """Create and populate the vector database"""
+MANIFEST_VERSION = 2
+
+def file_hash(path: Path) -> str:
+    """Hash file contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def section_hash(section: Dict) -> str:
+    """Hash everything that ends up in the vector store for a section"""
+    return hashlib.sha256(json.dumps(section, sort_keys=True).encode('utf-8')).hexdigest()
+
+def collection_for_file(config: Dict, file_name: str) -> str:
+    """Get the collection a PDF is indexed into, from the Act registry"""
+    for act in load_acts(config):
+        if file_name in act.files:
+            return act.collection
+    stem = re.sub(r'[^a-z0-9_-]+', '_', Path(file_name).stem.lower())
+    return f"{stem}_sections"
+
+def load_manifest(manifest_path: Path) -> Dict:
+    """Load the ingestion manifest, starting fresh if it is missing or outdated"""
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+        logger.warning("Ingestion manifest version changed, re-indexing everything")
+    return {'version': MANIFEST_VERSION, 'files': {}}
+
+def save_manifest(manifest_path: Path, manifest: Dict) -> None:
+    """Write the manifest atomically"""
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def section_ids(sections: Dict[str, Dict]) -> List[str]:
+    """All vector store IDs belonging to a file's sections"""
+    return [doc_id for section in sections.values() for doc_id in section['ids']]
+
+def ingest_file(pdf_path: Path, collection_name: str, text_processor: TextProcessor,
+                vector_store: BaseVectorStore, previous_sections: Dict[str, Dict], index_mode: str = "section",
+                batch_size: int = 64) -> Dict[str, Dict]:
+    """Upsert changed sections of a PDF and delete removed ones, returning the new section hashes and IDs"""
+    logger.info(f"Reading PDF file: {pdf_path}")
+    current_sections = {}
+    stats = {'sections': 0, 'changed': 0}
+
+    def changed_documents():
+        # Pages stream into the parser and changed sections stream into the vector store
+        pages = text_processor.iter_pdf_pages(str(pdf_path))
+        for section in text_processor.iter_sections(pages):
+            stats['sections'] += 1
+            section_id = vector_store.document_id(section)
+            # A repeated section number means the parser split the Act wrongly, and one of the two would be lost
+            if section_id in current_sections:
+                raise ValueError(f"Duplicate {section_id} in {pdf_path.name}, check how text_processor.py parses it")
+            documents = text_processor.chunk_section(section) if index_mode == "chunk" else [section]
+            content_hash = section_hash(section)
+            current_sections[section_id] = {
+                'hash': content_hash,
+                'ids': [vector_store.document_id(doc) for doc in documents]
+            }
+            previous = previous_sections.get(section_id)
+            if previous is None or previous['hash'] != content_hash:
+                stats['changed'] += 1
+                yield from documents
+    
+    vector_store.upsert_documents(collection_name, changed_documents(), batch_size=batch_size)
+    current_ids = set(section_ids(current_sections))
+    removed = [doc_id for doc_id in section_ids(previous_sections) if doc_id not in current_ids]
+    vector_store.delete_documents(collection_name, removed)
+    
+    logger.info(f"{pdf_path.name}: {stats['sections']} sections, {stats['changed']} changed, {len(removed)} documents removed")
+    return current_sections
+
+def create_vector_database(config_path: str = "config.yaml", input_path: Optional[str] = None, force: bool = False,
+                           bundle_directory: Optional[str] = None):
+    """Incrementally index every PDF in the input directory into the vector database, optionally exporting a bundle"""
     try:
         # Load configuration
         config = load_config(config_path)
         logger.info("Configuration loaded successfully")
-
+        ingestion_config = config.get('ingestion', {})
+        
         # Initialize components
         text_processor = TextProcessor(
             chunk_size=config['chunking']['chunk_size'],
-            chunk_overlap=config['chunking']['chunk_overlap']
+            chunk_overlap=config['chunking']['chunk_overlap'],
+            pdf_workers=ingestion_config.get('pdf_workers', 1)
         )
         
-        vector_store = VectorStore(
-            persist_directory=config['vector_db']['persist_directory'],
-            distance_strategy=config['vector_db']['distance_strategy']
-        )
+        vector_store = get_vector_store(config, get_encoder(config), use_bundle=False)
+        
+        # Changing how sections are split into documents, how they are embedded or where they are stored requires re-embedding
+        index_config = {
+            'vector_db': config['vector_db'].get('type', 'chroma'),
+            'index_mode': vector_store.index_mode,
+            'chunk_size': text_processor.chunk_size,
+            'chunk_overlap': text_processor.chunk_overlap,
+            'distance_strategy': vector_store.distance_strategy,
+            'model_name': vector_store.embeddings_handler.model_name,
+            'backend': vector_store.embeddings_handler.backend
+        }
+        
+        # Collect PDFs from a directory or a single file
+        input_path = Path(input_path or ingestion_config.get('input_directory', 'Input'))
+        if input_path.is_dir():
+            pdf_paths: List[Path] = sorted(p for p in input_path.iterdir() if p.suffix.lower() == '.pdf')
+        else:
+            pdf_paths = [input_path]
+        
+        manifest_path = Path(config['vector_db']['persist_directory']) / ingestion_config.get('manifest_file', 'ingest_manifest.json')
+        manifest = load_manifest(manifest_path)
         
-        # Read and process document
-        logger.info(f"Reading PDF file: {pdf_path}")
-        text = text_processor.read_pdf(pdf_path)
+        total_sections = 0
+        changed_collections = set()
+        for pdf_path in pdf_paths:
+            collection_name = collection_for_file(config, pdf_path.name)
+            content_hash = file_hash(pdf_path)
+            entry = manifest['files'].get(pdf_path.name)
+            
+            reindex = force or (entry is not None and entry.get('index') != index_config)
+            if entry and not reindex and entry['sha256'] == content_hash and entry['collection'] == collection_name:
+                logger.info(f"{pdf_path.name} unchanged, skipping")
+                total_sections += len(entry['sections'])
+                continue
+            
+            previous_sections = {}
+            if entry and entry['collection'] == collection_name:
+                previous_sections = entry['sections']
+                if reindex:
+                    previous_sections = {
+                        section_id: {'hash': None, 'ids': section['ids']}
+                        for section_id, section in previous_sections.items()
+                    }
+            elif entry:
+                vector_store.delete_documents(entry['collection'], section_ids(entry['sections']))
+                changed_collections.add(entry['collection'])
+            
+            sections = ingest_file(
+                pdf_path, collection_name, text_processor, vector_store, previous_sections,
+                index_mode=index_config['index_mode'],
+                batch_size=ingestion_config.get('write_batch_size', 64)
+            )
+            manifest['files'][pdf_path.name] = {
+                'sha256': content_hash,
+                'collection': collection_name,
+                'index': index_config,
+                'sections': sections
+            }
+            save_manifest(manifest_path, manifest)
+            total_sections += len(sections)
+            changed_collections.add(collection_name)
         
-        # Process into sections
-        logger.info("Processing text into sections")
-        sections = text_processor.process_text(text)
+        # Drop sections of PDFs that were removed from the input directory
+        if input_path.is_dir():
+            present = {pdf_path.name for pdf_path in pdf_paths}
+            for file_name in [name for name in manifest['files'] if name not in present]:
+                entry = manifest['files'].pop(file_name)
+                logger.info(f"{file_name} removed, deleting its sections")
+                vector_store.delete_documents(entry['collection'], section_ids(entry['sections']))
+                changed_collections.add(entry['collection'])
+            save_manifest(manifest_path, manifest)
         
-        # Add to vector store
-        logger.info("Adding sections to vector store")
-        vector_store.add_documents("bns_sections", sections)
+        # Rebuild BM25 indexes of collections whose contents changed
+        if vector_store.hybrid:
+            collections = changed_collections | {entry['collection'] for entry in manifest['files'].values()}
+            for collection_name in sorted(collections):
+                if collection_name in changed_collections or not BM25Index.exists(vector_store.sparse_index_path(collection_name)):
+                    logger.info(f"Building sparse index for {collection_name}")
+                    vector_store.build_sparse_index(collection_name)
         
+        vector_store.embeddings_handler.close_pool()
         logger.info("Vector database created successfully")
-        print(f"Created vector database with {len(sections)} sections")
+        print(f"Vector database contains {total_sections} sections from {len(pdf_paths)} files")
         print(f"Database location: {config['vector_db']['persist_directory']}")
         
+        if bundle_directory:
+            export_bundle(config, vector_store, bundle_directory, manifest['files'])
+            print(f"Index bundle written to {bundle_directory}")
+    
     except Exception as e:
         logger.error(f"Error creating vector database: {str(e)}")
         raise
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or update the vector database")
+    parser.add_argument("input_path", nargs="?", help="PDF file or directory (defaults to ingestion.input_directory)")
+    parser.add_argument("--force", action="store_true", help="re-embed every section")
+    parser.add_argument("--bundle", nargs="?", const="", metavar="DIR",
+                        help="also export an index bundle (defaults to vector_db.bundle_directory)")
+    args = parser.parse_args()
+    
+    bundle_directory = args.bundle
+    if bundle_directory == "":
+        bundle_directory = load_config("config.yaml")['vector_db'].get('bundle_directory', 'index_bundle')
+    
     print("Creating BNS Vector Database...")
-    create_vector_database()
-    print("Done!")
\ No newline at end of file
+    create_vector_database(input_path=args.input_path, force=args.force, bundle_directory=bundle_directory)
+    print("Done!")
@@ -1,21 +1,251 @@
 # embeddings_handler.py
 
-from sentence_transformers import SentenceTransformer
-import torch
-from typing import List
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from cache import EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+# Process-wide registry so every component shares one loaded model per (model_name, device, backend)
+_handlers: Dict[Tuple[str, str, str], "EmbeddingsHandler"] = {}
+_handlers_lock = threading.Lock()
+
+ONNX_MODEL_FILE = "model_int8.onnx"
+ONNX_CONFIG_FILE = "encoder.json"
+
+def onnx_export_dir(model_name: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+
+def export_onnx_model(model_name: str, export_dir: str) -> None:
+    """Export a sentence-transformers model to ONNX with int8 dynamically quantized weights"""
+    # Export needs torch, inference afterwards only needs onnxruntime and tokenizers
+    try:
+        import torch
+        from sentence_transformers import SentenceTransformer
+        from sentence_transformers.models import Normalize, Pooling
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError as e:
+        logger.error(f"No exported ONNX encoder in {export_dir} and exporting one needs requirements-torch.txt: {str(e)}")
+        raise
+
+    logger.info(f"Exporting {model_name} to ONNX in {export_dir}")
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = next(module for module in model if isinstance(module, Pooling))
+    os.makedirs(export_dir, exist_ok=True)
+    transformer.tokenizer.save_pretrained(export_dir)
+
+    inputs = transformer.tokenizer(["export"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in inputs]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    fp32_path = os.path.join(export_dir, "model.onnx")
+
+    class TokenEmbeddings(torch.nn.Module):
+        """Keyword inputs and a single output, independent of the model's forward signature"""
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *model_inputs):
+            return self.auto_model(**dict(zip(input_names, model_inputs))).last_hidden_state
+
+    with torch.no_grad():
+        torch.onnx.export(
+            TokenEmbeddings(transformer.auto_model).eval(),
+            tuple(inputs[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            dynamo=False
+        )
+    quantize_dynamic(fp32_path, os.path.join(export_dir, ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    with open(os.path.join(export_dir, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "max_seq_length": model.max_seq_length,
+            "pooling": getattr(pooling, "pooling_mode", None) or pooling.get_pooling_mode_str(),
+            "normalize": any(isinstance(module, Normalize) for module in model)
+        }, f, indent=2)
+
+class OnnxEncoder:
+    def __init__(self, model_name: str, cache_dir: str = "models/onnx", num_threads: int = 0, batch_size: int = 32):
+        """int8 ONNX Runtime encoder, exported from the sentence-transformers model on first use"""
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        export_dir = onnx_export_dir(model_name, cache_dir)
+        if not os.path.exists(os.path.join(export_dir, ONNX_CONFIG_FILE)):
+            export_onnx_model(model_name, export_dir)
+        with open(os.path.join(export_dir, ONNX_CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        if self.config["pooling"] not in ("mean", "cls"):
+            raise ValueError(f"Unsupported pooling mode for ONNX encoder: {self.config['pooling']}")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(export_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(export_dir, ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.batch_size = batch_size
+    
+    def encode(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        # Length-sorted batches keep padding short
+        batch_size = batch_size or self.batch_size
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+        embeddings = np.zeros((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[idx] for idx in batch])
+            feeds = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            }
+            hidden = self.session.run(None, {name: value for name, value in feeds.items() if name in self.input_names})[0]
+
+            if self.config["pooling"] == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = feeds["attention_mask"][:, :, None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.config["normalize"]:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+            if not embeddings.shape[1]:
+                embeddings = np.zeros((len(texts), pooled.shape[1]), dtype=np.float32)
+            embeddings[batch] = pooled
+        return embeddings
 
 class EmbeddingsHandler:
-    def __init__(self, model_name: str, device: str = "cpu"):
+    def __init__(self, model_name: str, device: str = "cpu", backend: str = "torch",
+                 num_threads: int = 0, onnx_cache_dir: str = "models/onnx", cache: Optional[EmbeddingCache] = None):
         """Initialize the embeddings model"""
         self.model_name = model_name
         self.device = device
-        self.model = SentenceTransformer(model_name).to(device)
+        self.backend = backend
+        self.cache = cache
+        # Quantized and fp32 vectors differ, so each backend has its own cache namespace
+        self.cache_namespace = f"{model_name}|{backend}"
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        if backend == "onnx":
+            if device != "cpu":
+                logger.warning(f"ONNX encoder runs on CPU, ignoring device {device}")
+            self.model = OnnxEncoder(model_name, onnx_cache_dir, num_threads)
+        elif backend == "torch":
+            import torch
+            from sentence_transformers import SentenceTransformer
+            if num_threads > 0:
+                torch.set_num_threads(num_threads)
+            self.model = SentenceTransformer(model_name).to(device)
+        else:
+            raise ValueError(f"Unsupported encoder backend: {backend}")
     
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for given texts"""
+    def encode(self, texts: List[str], batch_size: int = 32, workers: int = 1) -> np.ndarray:
+        """Generate embeddings as a float32 array, running the model only for texts not in the cache"""
+        if self.cache is None or not texts:
+            return self._encode(texts, batch_size, workers)
+        
+        vectors = self.cache.get_many(self.cache_namespace, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        metrics.record_cache("embedding", len(texts) - len(missing), len(missing))
+        if missing:
+            computed = self._encode(missing, batch_size, workers)
+            self.cache.put_many(self.cache_namespace, missing, computed)
+            by_text = dict(zip(missing, computed))
+            vectors = [by_text[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return np.stack(vectors)
+    
+    def _encode(self, texts: List[str], batch_size: int = 32, workers: int = 1) -> np.ndarray:
+        """Run the model, optionally spread over a pool of worker processes"""
         try:
-            with torch.no_grad():
-                embeddings = self.model.encode(texts)
-            return embeddings.tolist()
+            start = time.perf_counter()
+            if self.backend == "onnx":
+                # onnxruntime already parallelizes each batch across num_threads
+                embeddings = self.model.encode(texts, batch_size)
+            elif workers != 1 and len(texts) > batch_size:
+                embeddings = self.model.encode_multi_process(texts, self._get_pool(workers), batch_size=batch_size)
+            else:
+                import torch
+                with torch.no_grad():
+                    embeddings = self.model.encode(texts, batch_size=batch_size)
+            metrics.record_stage("encode", time.perf_counter() - start, texts=len(texts))
+            return np.asarray(embeddings, dtype=np.float32)
         except Exception as e:
-            raise Exception(f"Error generating embeddings: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error generating embeddings: {str(e)}")
+    
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for given texts"""
+        return self.encode(texts).tolist()
+    
+    def _get_pool(self, workers: int):
+        """Start the sentence-transformers process pool on first use, 0 workers meaning one per core"""
+        with self._pool_lock:
+            if self._pool is None:
+                workers = workers if workers > 0 else os.cpu_count() or 1
+                logger.info(f"Starting {workers} embedding worker processes")
+                self._pool = self.model.start_multi_process_pool([self.device] * workers)
+            return self._pool
+    
+    def close_pool(self) -> None:
+        """Stop the worker processes, if any were started"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
+    
+    def warmup(self) -> None:
+        """Run a dummy encode so the first real query doesn't pay the lazy-init cost"""
+        self.get_embeddings(["warmup"])
+
+def get_embeddings_handler(model_name: str, device: str = "cpu", warmup: bool = True, backend: str = "torch",
+                           num_threads: int = 0, onnx_cache_dir: str = "models/onnx",
+                           cache: Optional[EmbeddingCache] = None) -> EmbeddingsHandler:
+    """Get the shared embeddings handler for a model, loading it on first use"""
+    key = (model_name, device, backend)
+    with _handlers_lock:
+        handler = _handlers.get(key)
+        if handler is None:
+            logger.info(f"Loading embedding model {model_name} on {device} ({backend})")
+            start = time.perf_counter()
+            handler = EmbeddingsHandler(model_name, device, backend, num_threads, onnx_cache_dir, cache)
+            if warmup:
+                handler.warmup()
+            metrics.record_startup("encoder", time.perf_counter() - start)
+            _handlers[key] = handler
+    return handler
+
+if __name__ == "__main__":
+    import yaml
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export the configured encoder to int8 ONNX (needs requirements-torch.txt)")
+    parser.add_argument("--config", default="config.yaml")
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        encoder_config = yaml.safe_load(f)['encoder']
+    export_onnx_model(
+        encoder_config['model_name'],
+        onnx_export_dir(encoder_config['model_name'], encoder_config.get('onnx_cache_dir', 'models/onnx'))
+    )
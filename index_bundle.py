@@ -0,0 +1,178 @@
+# index_bundle.py
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+from embeddings_handler import EmbeddingsHandler
+from numpy_vector_store import NumpyVectorStore
+from vector_store import BaseVectorStore
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+BUNDLE_FILE = "bundle.json"
+
+class StaleBundleError(ValueError):
+    """The bundle was built from other source PDFs than the ones ingested or present now"""
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def bundle_index_config(config: Dict) -> Dict:
+    """Settings that must match between the bundle and the running app"""
+    return {
+        'index_mode': config['chunking'].get('index_mode', 'section'),
+        'chunk_size': config['chunking']['chunk_size'],
+        'chunk_overlap': config['chunking']['chunk_overlap'],
+        'distance_strategy': config['vector_db']['distance_strategy']
+    }
+
+def ingest_manifest_path(config: Dict) -> str:
+    """Where create_vectordb.py records the files indexed into the live store"""
+    return os.path.join(config['vector_db']['persist_directory'],
+                        config.get('ingestion', {}).get('manifest_file', 'ingest_manifest.json'))
+
+def current_sources(config: Dict) -> Optional[Dict[str, str]]:
+    """Checksums of the PDFs in the live store's ingest manifest, or in the input directory when nothing was ingested here"""
+    manifest_path = ingest_manifest_path(config)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            files = json.load(f).get('files', {})
+        return {name: entry['sha256'] for name, entry in files.items()}
+    input_directory = config.get('ingestion', {}).get('input_directory', 'Input')
+    if os.path.isdir(input_directory):
+        return {
+            name: file_sha256(os.path.join(input_directory, name))
+            for name in sorted(os.listdir(input_directory)) if name.lower().endswith('.pdf')
+        }
+    return None
+
+def _bundle_files(bundle_dir: str) -> List[str]:
+    files = []
+    for root, _, names in os.walk(bundle_dir):
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), bundle_dir)
+            if path != BUNDLE_FILE:
+                files.append(path.replace(os.sep, '/'))
+    return sorted(files)
+
+def export_bundle(config: Dict, vector_store: BaseVectorStore, bundle_dir: str, files: Dict[str, Dict]) -> Dict:
+    """Write embeddings, metadata and sparse indexes of the ingested files' collections as a self-describing bundle"""
+    # The stored vectors are described by the settings recorded when they were ingested, not by the encoder loaded now
+    indexes = {json.dumps(entry['index'], sort_keys=True) for entry in files.values()}
+    if len(indexes) != 1:
+        raise ValueError(f"Ingested files were indexed with {len(indexes)} different settings, re-index them with --force")
+    index = json.loads(indexes.pop())
+    collections = sorted({entry['collection'] for entry in files.values()})
+    sources = {name: entry['sha256'] for name, entry in files.items()}
+    
+    handler = vector_store.embeddings_handler
+    dtype = config['vector_db'].get('dtype', 'float32')
+    tmp_dir = f"{bundle_dir.rstrip('/')}.tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+
+    # The bundle uses the NumPy backend's layout so it can be memory-mapped as is
+    bundle_store = NumpyVectorStore(tmp_dir, index['distance_strategy'], handler, dtype=dtype,
+                                    index_mode=index['index_mode'])
+    dimension = 0
+    counts = {}
+    for collection_name in collections:
+        records, embeddings = vector_store.export_collection(collection_name)
+        if len(records['ids']):
+            bundle_store._write(collection_name, records['documents'], records['metadatas'], records['ids'],
+                                embeddings, upsert=True)
+            bundle_store._flush(collection_name)
+            dimension = embeddings.shape[1]
+        if vector_store.hybrid:
+            bundle_store.build_sparse_index(collection_name)
+        counts[collection_name] = len(records['ids'])
+        logger.info(f"Exported {counts[collection_name]} documents of {collection_name}")
+
+    manifest = {
+        'version': BUNDLE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'encoder': {'model_name': index['model_name'], 'backend': index['backend'], 'dimension': int(dimension)},
+        'index': {key: index[key] for key in bundle_index_config(config)},
+        'dtype': dtype,
+        'collections': counts,
+        'sources': sources,
+        'checksums': {path: file_sha256(os.path.join(tmp_dir, path)) for path in _bundle_files(tmp_dir)}
+    }
+    with open(os.path.join(tmp_dir, BUNDLE_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(bundle_dir):
+        shutil.rmtree(bundle_dir)
+    os.replace(tmp_dir, bundle_dir)
+    logger.info(f"Index bundle written to {bundle_dir}")
+    return manifest
+
+def verify_bundle(config: Dict, bundle_dir: str, embeddings_handler: EmbeddingsHandler,
+                  verify_checksums: bool = True) -> Dict:
+    """Check a bundle against the configured encoder and index settings, raising ValueError on any mismatch"""
+    with open(os.path.join(bundle_dir, BUNDLE_FILE), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ValueError(f"Index bundle version {manifest.get('version')} is not supported (expected {BUNDLE_VERSION})")
+
+    encoder = manifest['encoder']
+    if encoder['model_name'] != embeddings_handler.model_name:
+        raise ValueError(
+            f"Index bundle was built with encoder {encoder['model_name']}, but {embeddings_handler.model_name} is configured"
+        )
+    dimension = embeddings_handler.encode(["dimension check"]).shape[1]
+    if encoder['dimension'] and encoder['dimension'] != dimension:
+        raise ValueError(f"Index bundle has {encoder['dimension']}-dimensional embeddings, encoder produces {dimension}")
+    if encoder['backend'] != embeddings_handler.backend:
+        # int8 and fp32 vectors of the same model differ enough to quietly lower retrieval quality
+        message = f"Index bundle was embedded with the {encoder['backend']} backend, queries use {embeddings_handler.backend}"
+        if not config['vector_db'].get('allow_backend_mismatch', False):
+            raise ValueError(f"{message} (set vector_db.allow_backend_mismatch to accept it)")
+        logger.warning(message)
+
+    expected = bundle_index_config(config)
+    mismatched = [key for key, value in expected.items() if manifest['index'].get(key) != value]
+    if mismatched:
+        details = ", ".join(f"{key}: bundle {manifest['index'].get(key)!r}, config {expected[key]!r}" for key in mismatched)
+        raise ValueError(f"Index bundle does not match configuration ({details})")
+
+    # A bundle left over from before the PDFs were updated would shadow the re-indexed store
+    sources, bundle_sources = current_sources(config), manifest.get('sources', {})
+    if sources is not None and sources != bundle_sources:
+        changed = sorted(name for name in set(sources) | set(bundle_sources) if sources.get(name) != bundle_sources.get(name))
+        raise StaleBundleError(f"Index bundle was built from other versions of {changed}, rebuild it with create_vectordb.py --bundle")
+    
+    if verify_checksums:
+        for path, checksum in manifest['checksums'].items():
+            full_path = os.path.join(bundle_dir, path)
+            if not os.path.exists(full_path) or file_sha256(full_path) != checksum:
+                raise ValueError(f"Index bundle file {path} is missing or corrupt")
+
+    logger.info(f"Verified index bundle {bundle_dir} created {manifest['created']}")
+    return manifest
+
+if __name__ == "__main__":
+    from config_loader import load_config, get_encoder
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Verify an index bundle against the configuration")
+    parser.add_argument("bundle_dir", nargs="?", help="bundle directory (defaults to vector_db.bundle_directory)")
+    parser.add_argument("--config", default="config.yaml")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    bundle_dir = args.bundle_dir or config['vector_db'].get('bundle_directory', 'index_bundle')
+    manifest = verify_bundle(config, bundle_dir, get_encoder(config))
+    print(json.dumps({key: manifest[key] for key in ('created', 'encoder', 'index', 'dtype', 'collections')}, indent=2))
@@ -0,0 +1,448 @@
+# llm_gateway.py
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, PrivateAttr
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = (408, 409, 429)
+# Failures that say something about the provider rather than the request
+UNHEALTHY_STATUS = RETRYABLE_STATUS + (401, 403)
+CHARS_PER_TOKEN = 4
+UNAVAILABLE_MESSAGE = (
+    "The language model service is busy or unavailable at the moment. Please try again in a minute."
+)
+
+class LLMUnavailableError(Exception):
+    def __init__(self, errors: List[Tuple[str, Exception]]):
+        """Raised when every provider failed, with each provider's last error"""
+        self.errors = errors
+        details = "; ".join(f"{name}: {type(error).__name__}: {error}" for name, error in errors)
+        super().__init__(f"All LLM providers failed ({details})")
+
+class ProviderBusyError(Exception):
+    """The client-side rate limiter would hold the request longer than allowed"""
+
+def create_http_clients(max_connections: int = 50, timeout_seconds: float = 60) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Connection pools shared by all provider clients, sync and async"""
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    timeout = httpx.Timeout(timeout_seconds, connect=min(timeout_seconds, 10.0))
+    return httpx.Client(limits=limits, timeout=timeout), httpx.AsyncClient(limits=limits, timeout=timeout)
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections"""
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    # The provider SDKs wrap httpx errors in their own APIConnectionError / APITimeoutError
+    return isinstance(error, (httpx.TransportError, TimeoutError)) or \
+        any(name in type(error).__name__ for name in ("Timeout", "Connection"))
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, if it sent a Retry-After header"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    return sum(len(str(message.content)) for message in messages) // CHARS_PER_TOKEN + 1
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """Refill at per_minute up to capacity, a request may overdraw it and waits until the deficit is refilled"""
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, max_wait: Optional[float] = None) -> Optional[float]:
+        """Take amount, returning how long to wait before using it, or None without taking it if that exceeds max_wait"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            wait_seconds = max(0.0, (amount - self.tokens) / self.rate)
+            if max_wait is not None and wait_seconds > max_wait:
+                return None
+            self.tokens -= amount
+            return wait_seconds
+
+    def refund(self, amount: float) -> None:
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+class ProviderHealth:
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown_seconds: float = 30):
+        """Latency and failures of one provider, which is skipped for a cooldown after repeated failures"""
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+        metrics.record_provider_health(name, True)
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def record_success(self, seconds: float) -> None:
+        with self._lock:
+            recovered = self.consecutive_failures >= self.failure_threshold
+            self.requests += 1
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+            latency_ms = seconds * 1000
+            self.latency_ms = latency_ms if self.latency_ms is None else 0.8 * self.latency_ms + 0.2 * latency_ms
+        if recovered:
+            logger.info(f"LLM provider {self.name} recovered")
+            metrics.record_provider_health(self.name, True)
+
+    def record_failure(self, error: Exception) -> None:
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            # Still open after the cooldown, one failed probe request reopens it
+            opened = self.consecutive_failures >= self.failure_threshold
+            if opened:
+                self.open_until = time.monotonic() + self.cooldown_seconds
+        if opened:
+            logger.warning(
+                f"LLM provider {self.name} failed {self.consecutive_failures} times in a row, "
+                f"skipping it for {self.cooldown_seconds}s"
+            )
+            metrics.record_provider_health(self.name, False)
+
+    def as_dict(self) -> Dict:
+        return {
+            "available": self.available(),
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "last_error": self.last_error
+        }
+
+class LLMProvider:
+    def __init__(self, name: str, model: BaseChatModel, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, failure_threshold: int = 3, cooldown_seconds: float = 30):
+        """A provider's chat model with its client-side quota and health"""
+        self.name = name
+        self.model = model
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.health = ProviderHealth(name, failure_threshold, cooldown_seconds)
+
+    def admit(self, tokens: int, max_wait: Optional[float]) -> float:
+        """Reserve one request and the prompt tokens, returning the wait, or raise ProviderBusyError"""
+        request_wait = self.request_bucket.reserve(1, max_wait) if self.request_bucket else 0.0
+        if request_wait is None:
+            raise ProviderBusyError(f"{self.name} request quota exhausted")
+        token_wait = self.token_bucket.reserve(tokens, max_wait) if self.token_bucket else 0.0
+        if token_wait is None:
+            if self.request_bucket:
+                self.request_bucket.refund(1)
+            raise ProviderBusyError(f"{self.name} token quota exhausted")
+        return max(request_wait, token_wait)
+
+class LLMGateway(BaseChatModel):
+    """Chat model that spreads calls over providers with rate limiting, retries, hedging and failover"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    providers: List[Any]
+    max_retries: int = 3
+    backoff_base_seconds: float = 0.5
+    backoff_max_seconds: float = 8.0
+    max_queue_seconds: float = 5.0
+    hedge_after_seconds: float = 0.0
+    _executor: Optional[ThreadPoolExecutor] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        super().model_post_init(__context)
+        if self.hedge_after_seconds > 0 and len(self.providers) > 1:
+            self._executor = ThreadPoolExecutor(thread_name_prefix="llm-hedge")
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm_gateway"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"providers": [provider.name for provider in self.providers]}
+
+    def get_num_tokens(self, text: str) -> int:
+        """Count with the primary provider's tokenizer"""
+        return self.providers[0].model.get_num_tokens(text)
+
+    def health(self) -> Dict[str, Dict]:
+        return {provider.name: provider.health.as_dict() for provider in self.providers}
+
+    def _candidates(self) -> List[LLMProvider]:
+        """Providers in configured order, skipping those cooling down unless all are"""
+        return [provider for provider in self.providers if provider.health.available()] or list(self.providers)
+
+    def _hedge_timeout(self, queue: List[LLMProvider]) -> Optional[float]:
+        return self.hedge_after_seconds if queue and self.hedge_after_seconds > 0 else None
+
+    def _retry_delay(self, provider: LLMProvider, error: Exception, attempt: int, seconds: float) -> Optional[float]:
+        """Record a failed call, returning how long to back off before retrying it, or None to give up on the provider"""
+        if isinstance(error, ProviderBusyError):
+            return None
+        metrics.record_llm_call(provider.name, seconds, "error")
+        status = _status_code(error)
+        if is_retryable(error) or status in UNHEALTHY_STATUS:
+            provider.health.record_failure(error)
+        if not is_retryable(error) or attempt >= self.max_retries or not provider.health.available():
+            return None
+
+        # Full jitter keeps concurrent requests that hit the same 429 from retrying in lockstep
+        delay = random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+        requested = retry_after(error)
+        if requested is not None:
+            if requested > self.backoff_max_seconds:
+                return None
+            delay = max(delay, requested)
+        logger.warning(f"LLM call to {provider.name} failed ({type(error).__name__}: {error}), retrying in {delay:.2f}s")
+        return delay
+
+    def _record_success(self, provider: LLMProvider, seconds: float) -> None:
+        provider.health.record_success(seconds)
+        metrics.record_llm_call(provider.name, seconds, "ok")
+
+    def _admit(self, provider: LLMProvider, messages: List[BaseMessage], last: bool) -> float:
+        # The last provider has nobody to fail over to, so it waits for its quota however long it takes
+        wait_seconds = provider.admit(estimate_tokens(messages), None if last else self.max_queue_seconds)
+        if wait_seconds > 0:
+            metrics.record_stage("llm_rate_limit", wait_seconds, provider=provider.name)
+        return wait_seconds
+
+    def _call(self, provider: LLMProvider, messages: List[BaseMessage], last: bool, **kwargs) -> BaseMessage:
+        attempt = 0
+        while True:
+            time.sleep(self._admit(provider, messages, last))
+            start = time.perf_counter()
+            try:
+                message = provider.model.invoke(messages, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(provider, e, attempt, time.perf_counter() - start)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._record_success(provider, time.perf_counter() - start)
+            return message
+
+    async def _acall(self, provider: LLMProvider, messages: List[BaseMessage], last: bool, **kwargs) -> BaseMessage:
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._admit(provider, messages, last))
+            start = time.perf_counter()
+            try:
+                message = await provider.model.ainvoke(messages, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(provider, e, attempt, time.perf_counter() - start)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._record_success(provider, time.perf_counter() - start)
+            return message
+
+    def _run(self, call: Callable[[LLMProvider, bool], BaseMessage]) -> BaseMessage:
+        """Call providers in order until one answers, starting the next early if hedging is enabled"""
+        queue = self._candidates()
+        errors = []
+        if self._executor is None:
+            while queue:
+                provider = queue.pop(0)
+                try:
+                    return call(provider, not queue)
+                except Exception as e:
+                    errors.append((provider.name, e))
+                    if queue:
+                        logger.warning(f"LLM provider {provider.name} failed ({type(e).__name__}), failing over to {queue[0].name}")
+            raise LLMUnavailableError(errors)
+
+        futures = {}
+
+        def launch() -> None:
+            provider = queue.pop(0)
+            futures[self._executor.submit(metrics.bind(call), provider, not queue)] = provider
+
+        launch()
+        while futures:
+            done, _ = wait(futures, timeout=self._hedge_timeout(queue), return_when=FIRST_COMPLETED)
+            if not done:
+                logger.info(f"No answer within {self.hedge_after_seconds}s, hedging with {queue[0].name}")
+                launch()
+                continue
+            for future in done:
+                provider = futures.pop(future)
+                try:
+                    # A slower hedge that is still running is left to finish in the background
+                    return future.result()
+                except Exception as e:
+                    errors.append((provider.name, e))
+            if queue:
+                logger.warning(f"LLM provider {errors[-1][0]} failed ({type(errors[-1][1]).__name__}), failing over to {queue[0].name}")
+                launch()
+        raise LLMUnavailableError(errors)
+
+    async def _arun(self, call: Callable[[LLMProvider, bool], Awaitable[BaseMessage]]) -> BaseMessage:
+        """Async variant of _run, cancelling the slower request once one answers"""
+        queue = self._candidates()
+        errors = []
+        tasks = {}
+
+        def launch() -> None:
+            provider = queue.pop(0)
+            tasks[asyncio.ensure_future(call(provider, not queue))] = provider
+
+        launch()
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=self._hedge_timeout(queue), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"No answer within {self.hedge_after_seconds}s, hedging with {queue[0].name}")
+                    launch()
+                    continue
+                for task in done:
+                    provider = tasks.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        errors.append((provider.name, e))
+                if queue:
+                    logger.warning(f"LLM provider {errors[-1][0]} failed ({type(errors[-1][1]).__name__}), failing over to {queue[0].name}")
+                    launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise LLMUnavailableError(errors)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = self._run(lambda provider, last: self._call(provider, messages, last, stop=stop, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        message = await self._arun(lambda provider, last: self._acall(provider, messages, last, stop=stop, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        """Stream from the first provider that starts answering, a stream that breaks after its first token is not retried"""
+        queue = self._candidates()
+        errors = []
+        while queue:
+            provider = queue.pop(0)
+            attempt = 0
+            while True:
+                started = False
+                start = time.perf_counter()
+                try:
+                    time.sleep(self._admit(provider, messages, not queue))
+                    start = time.perf_counter()
+                    for chunk in provider.model.stream(messages, stop=stop, **kwargs):
+                        started = True
+                        generation = ChatGenerationChunk(message=chunk)
+                        if run_manager:
+                            run_manager.on_llm_new_token(str(chunk.content), chunk=generation)
+                        yield generation
+                except Exception as e:
+                    delay = self._retry_delay(provider, e, attempt, time.perf_counter() - start)
+                    if started:
+                        raise
+                    if delay is not None:
+                        time.sleep(delay)
+                        attempt += 1
+                        continue
+                    errors.append((provider.name, e))
+                    if queue:
+                        logger.warning(f"LLM provider {provider.name} failed ({type(e).__name__}), failing over to {queue[0].name}")
+                    break
+                self._record_success(provider, time.perf_counter() - start)
+                return
+        raise LLMUnavailableError(errors)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        """Async variant of _stream"""
+        queue = self._candidates()
+        errors = []
+        while queue:
+            provider = queue.pop(0)
+            attempt = 0
+            while True:
+                started = False
+                start = time.perf_counter()
+                try:
+                    await asyncio.sleep(self._admit(provider, messages, not queue))
+                    start = time.perf_counter()
+                    async for chunk in provider.model.astream(messages, stop=stop, **kwargs):
+                        started = True
+                        generation = ChatGenerationChunk(message=chunk)
+                        if run_manager:
+                            await run_manager.on_llm_new_token(str(chunk.content), chunk=generation)
+                        yield generation
+                except Exception as e:
+                    delay = self._retry_delay(provider, e, attempt, time.perf_counter() - start)
+                    if started:
+                        raise
+                    if delay is not None:
+                        await asyncio.sleep(delay)
+                        attempt += 1
+                        continue
+                    errors.append((provider.name, e))
+                    if queue:
+                        logger.warning(f"LLM provider {provider.name} failed ({type(e).__name__}), failing over to {queue[0].name}")
+                    break
+                self._record_success(provider, time.perf_counter() - start)
+                return
+        raise LLMUnavailableError(errors)
+
+def user_error_message(error: Exception) -> Optional[str]:
+    """Message shown instead of the generic error when no provider could answer"""
+    return UNAVAILABLE_MESSAGE if isinstance(error, LLMUnavailableError) else None
@@ -0,0 +1,145 @@
+# llm_stub_server.py
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+class StubBehaviour:
+    def __init__(self, reply: str, latency: float = 0.0, rate_limit_rate: float = 0.0, error_rate: float = 0.0,
+                 retry_after: float = 1.0, token_delay: float = 0.0):
+        """What the stub answers and how often it fails"""
+        self.reply = reply
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.token_delay = token_delay
+        self.requests = 0
+        self._lock = threading.Lock()
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible chat completions, served on any path ending in /chat/completions (Groq uses /openai/v1)"""
+    protocol_version = "HTTP/1.1"
+    behaviour: StubBehaviour = None
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        behaviour = self.behaviour
+        with behaviour._lock:
+            behaviour.requests += 1
+        time.sleep(behaviour.latency)
+        roll = random.random()
+        if roll < behaviour.rate_limit_rate:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                            {"Retry-After": str(behaviour.retry_after)})
+            return
+        if roll < behaviour.rate_limit_rate + behaviour.error_rate:
+            self._send_json(503, {"error": {"message": "Service unavailable", "type": "server_error"}})
+            return
+
+        model = request.get("model", "stub")
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in request.get("messages", [])) // 4
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        if request.get("stream"):
+            self._stream(completion_id, model)
+            return
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": behaviour.reply}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(behaviour.reply) // 4,
+                "total_tokens": prompt_tokens + len(behaviour.reply) // 4
+            }
+        })
+
+    def _stream(self, completion_id: str, model: str) -> None:
+        """Server-sent events, one word per chunk, closing the connection at the end"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(delta: dict, finish_reason: str = None) -> None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send({"role": "assistant", "content": ""})
+        for word in self.behaviour.reply.split(" "):
+            time.sleep(self.behaviour.token_delay)
+            send({"content": word + " "})
+        send({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def handle_one_request(self) -> None:
+        # Clients that gave up (timeouts, cancelled hedges) are expected
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+def start_stub_server(behaviour: StubBehaviour, host: str = "127.0.0.1", port: int = 8090) -> ThreadingHTTPServer:
+    """Serve the stub on a daemon thread, for pointing llm.models.*.base_url at in tests"""
+    handler = type("StubHandler", (_StubHandler,), {"behaviour": behaviour})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="llm-stub").start()
+    logger.info(f"LLM stub server listening on http://{host}:{server.server_address[1]}")
+    return server
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible chat completions server for testing the LLM gateway")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--reply", default="The answer is BNS Section 351 about criminal intimidation.")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before answering")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed words")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    args = parser.parse_args()
+
+    server = start_stub_server(
+        StubBehaviour(args.reply, args.latency, args.rate_limit_rate, args.error_rate, args.retry_after, args.token_delay),
+        args.host, args.port
+    )
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
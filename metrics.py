@@ -0,0 +1,394 @@
+# metrics.py
+
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: bucket counts (not cumulative), sum, count
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total[0])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        """Named metrics rendered together in the Prometheus text format"""
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "legal_assistant_stage_seconds", "Duration of each query processing stage", ("stage",)
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "legal_assistant_request_seconds", "End-to-end query processing time", ("mode", "outcome")
+))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "legal_assistant_prompt_tokens", "Tokens in the response prompt", ("part",), TOKEN_BUCKETS
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "legal_assistant_cache_requests_total", "Cache lookups", ("cache", "result")
+))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "legal_assistant_startup_seconds", "Model load and startup times", ("component",)
+))
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "legal_assistant_llm_request_seconds", "LLM provider calls, including failed attempts", ("provider", "outcome")
+))
+LLM_PROVIDER_UP = REGISTRY.register(Gauge(
+    "legal_assistant_llm_provider_up", "Whether the gateway is sending requests to the LLM provider", ("provider",)
+))
+
+_current_trace: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar("current_trace", default=None)
+_trace_log_path: Optional[str] = None
+_trace_log_lock = threading.Lock()
+
+class RequestTrace:
+    def __init__(self, mode: str):
+        """Stage timings and attributes of one query, written to the trace log when it finishes"""
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.mode = mode
+        self.started = time.time()
+        self.outcome = "ok"
+        self.stages: List[Dict] = []
+        self.attributes: Dict = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self) -> Iterator["RequestTrace"]:
+        """Make this the current trace, must not span a generator yield"""
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def add_stage(self, name: str, seconds: float, **attributes) -> None:
+        with self._lock:
+            self.stages.append({"stage": name, "ms": round(seconds * 1000, 2), **attributes})
+
+    def annotate(self, **attributes) -> None:
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def fail(self, error: Exception) -> None:
+        self.outcome = "error"
+        self.annotate(error=type(error).__name__)
+
+    def finish(self) -> None:
+        seconds = time.perf_counter() - self._start
+        REQUEST_SECONDS.observe(seconds, mode=self.mode, outcome=self.outcome)
+        if _trace_log_path:
+            record = {
+                "trace_id": self.trace_id,
+                "started": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(self.started)),
+                "mode": self.mode,
+                "outcome": self.outcome,
+                "total_ms": round(seconds * 1000, 2),
+                "stages": self.stages,
+                **self.attributes
+            }
+            try:
+                with _trace_log_lock, open(_trace_log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logger.error(f"Error writing trace log: {str(e)}")
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+@contextmanager
+def trace_request(mode: str) -> Iterator[RequestTrace]:
+    """Trace a request handled by a plain (non-generator) function"""
+    trace = RequestTrace(mode)
+    try:
+        with trace.activate():
+            yield trace
+    except Exception as e:
+        trace.fail(e)
+        raise
+    finally:
+        trace.finish()
+
+def traced(mode: str) -> Callable:
+    """Trace every call of a function, coroutine function, generator or async generator"""
+    def decorator(fn: Callable) -> Callable:
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def async_gen_wrapper(*args, **kwargs):
+                trace = RequestTrace(mode)
+                gen = fn(*args, **kwargs)
+                try:
+                    while True:
+                        # Active only while the generator runs, consumers may resume it from another context
+                        with trace.activate():
+                            try:
+                                item = await gen.__anext__()
+                            except StopAsyncIteration:
+                                return
+                        yield item
+                except Exception as e:
+                    trace.fail(e)
+                    raise
+                finally:
+                    await gen.aclose()
+                    trace.finish()
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                trace = RequestTrace(mode)
+                gen = fn(*args, **kwargs)
+                try:
+                    while True:
+                        with trace.activate():
+                            try:
+                                item = next(gen)
+                            except StopIteration:
+                                return
+                        yield item
+                except Exception as e:
+                    trace.fail(e)
+                    raise
+                finally:
+                    gen.close()
+                    trace.finish()
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with trace_request(mode):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace_request(mode):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_stage(name: str, seconds: float, trace: Optional[RequestTrace] = None, **attributes) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = trace or current_trace()
+    if trace is not None:
+        trace.add_stage(name, seconds, **attributes)
+
+@contextmanager
+def stage(name: str, trace: Optional[RequestTrace] = None, **attributes) -> Iterator[None]:
+    """Time a block as a stage of the current (or given) trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start, trace, **attributes)
+
+def timed_iter(iterator: Iterable, name: str) -> Iterator:
+    """Pass items through, recording time to the first item and to the end as stages"""
+    start = time.perf_counter()
+    first = True
+    for item in iterator:
+        if first:
+            record_stage(f"{name}_first_token", time.perf_counter() - start)
+            first = False
+        yield item
+    record_stage(name, time.perf_counter() - start)
+
+async def atimed_iter(iterator: AsyncIterator, name: str) -> AsyncIterator:
+    """Async variant of timed_iter"""
+    start = time.perf_counter()
+    first = True
+    async for item in iterator:
+        if first:
+            record_stage(f"{name}_first_token", time.perf_counter() - start)
+            first = False
+        yield item
+    record_stage(name, time.perf_counter() - start)
+
+def annotate(**attributes) -> None:
+    trace = current_trace()
+    if trace is not None:
+        trace.annotate(**attributes)
+
+def fail(error: Exception) -> None:
+    """Mark the current request as failed when its error is handled rather than raised"""
+    trace = current_trace()
+    if trace is not None:
+        trace.fail(error)
+
+def record_cache(cache: str, hits: int, misses: int = 0) -> None:
+    CACHE_REQUESTS.inc(hits, cache=cache, result="hit")
+    CACHE_REQUESTS.inc(misses, cache=cache, result="miss")
+    trace = current_trace()
+    if trace is not None:
+        trace.count(f"{cache}_cache_hits", hits)
+        trace.count(f"{cache}_cache_misses", misses)
+
+def record_tokens(**parts: int) -> None:
+    for part, tokens in parts.items():
+        PROMPT_TOKENS.observe(tokens, part=part)
+    trace = current_trace()
+    if trace is not None:
+        trace.annotate(**{f"{part}_tokens": tokens for part, tokens in parts.items()})
+
+def record_llm_call(provider: str, seconds: float, outcome: str) -> None:
+    LLM_REQUEST_SECONDS.observe(seconds, provider=provider, outcome=outcome)
+    trace = current_trace()
+    if trace is not None:
+        trace.count(f"llm_{provider}_{outcome}")
+
+def record_provider_health(provider: str, up: bool) -> None:
+    LLM_PROVIDER_UP.set(1 if up else 0, provider=provider)
+
+def record_startup(component: str, seconds: float) -> None:
+    STARTUP_SECONDS.set(seconds, component=component)
+    logger.info(f"Startup: {component} took {seconds:.2f} s")
+
+def bind(fn: Callable) -> Callable:
+    """Run fn under the current trace, e.g. in an executor thread, which does not inherit it"""
+    trace = current_trace()
+    if trace is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with trace.activate():
+            return fn(*args, **kwargs)
+    return run
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(host: str = "0.0.0.0", port: int = 9100) -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread, once per process"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            logger.info(f"Metrics available at http://{host}:{port}/metrics")
+        return _server
+
+def set_trace_log(path: Optional[str]) -> None:
+    """Append one JSON line per finished request to path, None to stop"""
+    global _trace_log_path
+    _trace_log_path = path or None
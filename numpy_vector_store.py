@@ -0,0 +1,220 @@
+# numpy_vector_store.py
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embeddings_handler import EmbeddingsHandler
+from vector_store import BaseVectorStore
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per matrix product, so float16 matrices are upcast one block at a time
+SCORE_BLOCK_ROWS = 16384
+
+class _Collection:
+    """Normalized embeddings as one matrix, with documents and metadata kept column-wise"""
+    def __init__(self, embeddings: np.ndarray, ids: List[str], documents: List[str], columns: Dict[str, List]):
+        self.embeddings = embeddings
+        self.ids = ids
+        self.documents = documents
+        self.columns = columns
+        self.rows = {doc_id: row for row, doc_id in enumerate(ids)}
+        self.pending: List[np.ndarray] = []
+        self.dirty = False
+
+    def metadata(self, row: int) -> Dict:
+        return {key: values[row] for key, values in self.columns.items() if values[row] is not None}
+
+    def records(self, rows: List[int]) -> Dict[str, List]:
+        return {
+            'ids': [self.ids[row] for row in rows],
+            'documents': [self.documents[row] for row in rows],
+            'metadatas': [self.metadata(row) for row in rows]
+        }
+
+    def append(self, doc_id: str, document: str, metadata: Dict, vector: np.ndarray) -> None:
+        row = len(self.ids)
+        self.rows[doc_id] = row
+        self.ids.append(doc_id)
+        self.documents.append(document)
+        for key in metadata:
+            if key not in self.columns:
+                self.columns[key] = [None] * row
+        for key, values in self.columns.items():
+            values.append(metadata.get(key))
+        self.pending.append(vector)
+
+    def overwrite(self, row: int, document: str, metadata: Dict, vector: np.ndarray) -> None:
+        self.compact()
+        if not self.embeddings.flags.writeable:
+            # Copy a memory-mapped matrix into memory before the first in-place write
+            self.embeddings = np.array(self.embeddings)
+        self.embeddings[row] = vector
+        self.documents[row] = document
+        for key in metadata:
+            if key not in self.columns:
+                self.columns[key] = [None] * len(self.ids)
+        for key, values in self.columns.items():
+            values[row] = metadata.get(key)
+
+    def compact(self) -> None:
+        """Append rows written since the last call to the embeddings matrix"""
+        if self.pending:
+            self.embeddings = np.concatenate([self.embeddings, np.stack(self.pending).astype(self.embeddings.dtype)])
+            self.pending = []
+
+    def remove(self, ids: List[str]) -> int:
+        self.compact()
+        drop = {self.rows[doc_id] for doc_id in ids if doc_id in self.rows}
+        if not drop:
+            return 0
+        keep = [row for row in range(len(self.ids)) if row not in drop]
+        self.embeddings = self.embeddings[keep]
+        self.ids = [self.ids[row] for row in keep]
+        self.documents = [self.documents[row] for row in keep]
+        self.columns = {key: [values[row] for row in keep] for key, values in self.columns.items()}
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return len(drop)
+
+class NumpyVectorStore(BaseVectorStore):
+    def __init__(self, persist_directory: str, distance_strategy: str, embeddings_handler: EmbeddingsHandler,
+                 dtype: str = "float32", **kwargs):
+        """Exact nearest-neighbour search over embeddings held in memory-mapped .npy files"""
+        super().__init__(persist_directory, distance_strategy, embeddings_handler, **kwargs)
+        if distance_strategy not in ("cosine", "ip", "l2"):
+            raise ValueError(f"Unsupported distance strategy: {distance_strategy}")
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float16):
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self._collections: Dict[str, _Collection] = {}
+        self._lock = threading.Lock()
+
+    def collection_path(self, collection_name: str) -> str:
+        return os.path.join(self.persist_directory, "numpy", collection_name)
+
+    def _collection(self, collection_name: str) -> _Collection:
+        """Load a collection on first use, memory-mapping its embeddings"""
+        with self._lock:
+            if collection_name not in self._collections:
+                self._collections[collection_name] = self._load(collection_name)
+            return self._collections[collection_name]
+
+    def _load(self, collection_name: str) -> _Collection:
+        path = self.collection_path(collection_name)
+        if not os.path.exists(os.path.join(path, "documents.json")):
+            return _Collection(np.zeros((0, 0), dtype=self.dtype), [], [], {})
+
+        with open(os.path.join(path, "documents.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        collection = _Collection(embeddings, data["ids"], data["documents"], data["metadata"])
+        if embeddings.dtype != self.dtype:
+            logger.info(f"Converting {collection_name} embeddings from {embeddings.dtype} to {self.dtype}")
+            collection.embeddings = embeddings.astype(self.dtype)
+            collection.dirty = True
+        logger.info(f"Loaded {len(collection.ids)} vectors for collection {collection_name}")
+        return collection
+
+    def _save(self, collection_name: str, collection: _Collection) -> None:
+        """Write the matrix and columns to temporary files and swap them in"""
+        path = self.collection_path(collection_name)
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "embeddings.tmp.npy"), collection.embeddings)
+        with open(os.path.join(path, "documents.tmp.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": collection.ids, "documents": collection.documents, "metadata": collection.columns}, f)
+        os.replace(os.path.join(path, "embeddings.tmp.npy"), os.path.join(path, "embeddings.npy"))
+        os.replace(os.path.join(path, "documents.tmp.json"), os.path.join(path, "documents.json"))
+        collection.dirty = False
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+    
+    def _write(self, collection_name: str, docs: List[str], metadatas: List[Dict], ids: List[str],
+               embeddings: np.ndarray, upsert: bool) -> None:
+        vectors = self._normalize(embeddings)
+        collection = self._collection(collection_name)
+        with self._lock:
+            if not collection.ids:
+                collection.embeddings = np.zeros((0, vectors.shape[1]), dtype=self.dtype)
+            for doc_id, document, metadata, vector in zip(ids, docs, metadatas, vectors):
+                row = collection.rows.get(doc_id)
+                if row is None:
+                    collection.append(doc_id, document, metadata, vector)
+                elif upsert:
+                    collection.overwrite(row, document, metadata, vector)
+                else:
+                    logger.warning(f"Document {doc_id} already exists in {collection_name}, skipping")
+                    continue
+                collection.dirty = True
+
+    def _flush(self, collection_name: str) -> None:
+        collection = self._collection(collection_name)
+        with self._lock:
+            collection.compact()
+            if collection.dirty:
+                self._save(collection_name, collection)
+
+    def _delete(self, collection_name: str, ids: List[str]) -> None:
+        collection = self._collection(collection_name)
+        with self._lock:
+            if collection.remove(ids):
+                collection.dirty = True
+
+    def _get(self, collection_name: str, ids: Optional[List[str]] = None,
+             section_nums: Optional[List[str]] = None) -> Dict[str, List]:
+        collection = self._collection(collection_name)
+        if ids is not None:
+            rows = [collection.rows[doc_id] for doc_id in ids if doc_id in collection.rows]
+        elif section_nums is not None:
+            wanted = set(section_nums)
+            rows = [row for row, section_num in enumerate(collection.columns.get('section_num', [])) if section_num in wanted]
+        else:
+            rows = list(range(len(collection.ids)))
+        return collection.records(rows)
+
+    def export_collection(self, collection_name: str) -> Tuple[Dict[str, List], np.ndarray]:
+        collection = self._collection(collection_name)
+        with self._lock:
+            collection.compact()
+        return collection.records(list(range(len(collection.ids)))), np.asarray(collection.embeddings, dtype=np.float32)
+    
+    def _query(self, collection_name: str, queries: List[str], n_results: int) -> Dict[str, List[List]]:
+        collection = self._collection(collection_name)
+        with self._lock:
+            collection.compact()
+        num_docs = len(collection.ids)
+        if not num_docs or not queries:
+            return {'ids': [[] for _ in queries], 'documents': [[] for _ in queries],
+                    'metadatas': [[] for _ in queries], 'distances': [[] for _ in queries]}
+
+        # Cosine similarity of every query against every row in one product per block
+        query_vectors = self._normalize(self.embeddings_handler.encode(list(queries)))
+        scores = np.empty((len(queries), num_docs), dtype=np.float32)
+        for start in range(0, num_docs, SCORE_BLOCK_ROWS):
+            block = np.asarray(collection.embeddings[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = query_vectors @ block.T
+
+        # Exact top k per query
+        k = min(n_results, num_docs)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        # Same distance conventions as Chroma
+        distances = 2 - 2 * top_scores if self.distance_strategy == "l2" else 1 - top_scores
+        records = [collection.records(rows.tolist()) for rows in top]
+        return {
+            'ids': [record['ids'] for record in records],
+            'documents': [record['documents'] for record in records],
+            'metadatas': [record['metadatas'] for record in records],
+            'distances': distances.tolist()
+        }
@@ -0,0 +1,103 @@
+# phrase_extractor.py
+
+import logging
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embeddings_handler import EmbeddingsHandler
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    "a", "about", "after", "against", "all", "am", "an", "and", "any", "are", "as", "at", "be", "been",
+    "before", "being", "by", "can", "could", "did", "do", "does", "for", "from", "had", "has", "have",
+    "he", "her", "him", "his", "how", "i", "if", "in", "into", "is", "it", "its", "me", "my", "of", "on",
+    "or", "our", "she", "should", "so", "some", "that", "the", "their", "them", "then", "there", "they",
+    "this", "to", "up", "us", "was", "we", "were", "what", "when", "where", "which", "who", "whom", "why",
+    "will", "with", "would", "you", "your", "section", "sections", "act", "law", "legal", "case", "help",
+    "want", "need", "tell", "please", "explain"
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+CHAPTER_PREFIX_PATTERN = re.compile(r"^chapter\s+[ivxlcdm]+\s*", re.IGNORECASE)
+
+def _stem(token: str) -> str:
+    """Crude suffix stripping so that e.g. 'threatened' and 'threat' match"""
+    for suffix in ("ening", "ened", "ing", "ed", "es", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+def _keywords(text: str) -> List[str]:
+    return [_stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class LocalPhraseExtractor:
+    def __init__(self, sections: List[Dict], embeddings_handler: Optional[EmbeddingsHandler] = None,
+                 max_phrases: int = 6, keyword_weight: float = 0.5):
+        """Build a search vocabulary from section titles and chapter headings"""
+        self.max_phrases = max_phrases
+        self.keyword_weight = keyword_weight
+        self.embeddings_handler = embeddings_handler
+
+        # Vocabulary of candidate phrases
+        phrases = []
+        for section in sections:
+            phrases.append(section.get('title', ''))
+            chapter_title = section.get('chapter_title') or CHAPTER_PREFIX_PATTERN.sub('', section.get('chapter', ''))
+            phrases.append(chapter_title)
+        phrases = [re.sub(r'\s+', ' ', phrase).strip(' .,;:-').lower() for phrase in phrases]
+        self.phrases = list(dict.fromkeys(phrase for phrase in phrases if phrase))
+
+        # Inverted keyword index with inverse document frequencies
+        self.phrase_keywords = [set(_keywords(phrase)) for phrase in self.phrases]
+        doc_freq: Dict[str, int] = {}
+        for keywords in self.phrase_keywords:
+            for keyword in keywords:
+                doc_freq[keyword] = doc_freq.get(keyword, 0) + 1
+        total = max(len(self.phrases), 1)
+        self.idf = {keyword: float(np.log(1 + total / freq)) for keyword, freq in doc_freq.items()}
+
+        # Normalized phrase embeddings for nearest-neighbour lookup
+        self.phrase_embeddings = None
+        if embeddings_handler is not None and self.phrases:
+            embeddings = embeddings_handler.encode(self.phrases)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            self.phrase_embeddings = embeddings / np.where(norms == 0, 1, norms)
+
+        logger.info(f"Local phrase extractor built with {len(self.phrases)} phrases")
+
+    def extract(self, query: str) -> List[str]:
+        """Extract search phrases for a query without calling the LLM"""
+        query_keywords = _keywords(query)
+        phrases = []
+        if query_keywords:
+            phrases.append(' '.join(TOKEN_PATTERN.findall(query.lower())[:12]))
+
+        if not self.phrases:
+            return phrases
+
+        # Keyword overlap weighted by rarity
+        keyword_scores = np.zeros(len(self.phrases), dtype=np.float32)
+        query_set = set(query_keywords)
+        for idx, keywords in enumerate(self.phrase_keywords):
+            matched = query_set & keywords
+            if matched:
+                keyword_scores[idx] = sum(self.idf[k] for k in matched) / np.sqrt(len(keywords))
+        if keyword_scores.max() > 0:
+            keyword_scores /= keyword_scores.max()
+
+        # Embedding nearest neighbours
+        scores = self.keyword_weight * keyword_scores
+        if self.phrase_embeddings is not None:
+            query_embedding = self.embeddings_handler.encode([query])[0]
+            norm = np.linalg.norm(query_embedding)
+            if norm:
+                scores = scores + self.phrase_embeddings @ (query_embedding / norm)
+
+        for idx in np.argsort(-scores)[:self.max_phrases]:
+            if scores[idx] > 0:
+                phrases.append(self.phrases[idx])
+
+        return list(dict.fromkeys(phrases))
@@ -1,18 +1,38 @@
 # query_assistant.py
 
+import asyncio
+import hashlib
 import logging
 import re
-from typing import List, Dict, Union
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Tuple, Union
 from datetime import datetime
-from config_loader import load_config, get_llm, get_encoder
-from vector_store import VectorStore
+from config_loader import (
+    load_config,
+    get_llm,
+    get_encoder,
+    get_vector_store,
+    get_response_cache,
+    get_phrase_cache,
+    get_local_phrase_extractor,
+    get_context_builder,
+    get_act_router,
+    get_reranker,
+    start_metrics
+)
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+import metrics
+from act_router import Act
+from llm_gateway import user_error_message
 from utils import (
     handle_error_response,
-    get_conversation_context,
     is_simple_context_question,
-    get_simple_context_answer
+    get_simple_context_answer,
+    normalize_query,
+    extract_section_citations,
+    strip_qualified_citations
 )
 
 logger = logging.getLogger(__name__)
@@ -21,15 +41,33 @@ class QueryAssistant:
     def __init__(self, config_path: str = "config.yaml"):
         """Initialize Query Assistant"""
         try:
+            start = time.perf_counter()
             self.config = load_config(config_path)
+            start_metrics(self.config)
             # Initialize components
             self.llm = get_llm(self.config)
             self.embedding_function = get_encoder(self.config)
 
-            self.vector_store = VectorStore(
-                persist_directory=self.config['vector_db']['persist_directory'],
-                distance_strategy=self.config['vector_db']['distance_strategy']
+            vector_store_start = time.perf_counter()
+            self.vector_store = get_vector_store(self.config, self.embedding_function)
+            metrics.record_startup("vector_store", time.perf_counter() - vector_store_start)
+            self.response_cache = get_response_cache(self.config)
+            self.phrase_cache = get_phrase_cache(self.config)
+            self.act_router = get_act_router(self.config)
+            self.local_phrase_extractor = get_local_phrase_extractor(
+                self.config, self.vector_store, self.act_router.default_acts[0].collection
             )
+            self.context_builder = get_context_builder(self.config, self.llm)
+            self.reranker = get_reranker(self.config)
+            
+            # Concurrency limits for the async interface
+            concurrency_config = self.config.get('concurrency', {})
+            search_workers = concurrency_config.get('search_workers', 8)
+            self.executor = ThreadPoolExecutor(max_workers=search_workers)
+            self.request_semaphore = asyncio.Semaphore(concurrency_config.get('max_concurrent_requests', 16))
+            # Separate pool for fanning out to Act collections, which may itself run inside the executor,
+            # with room for every search worker to fan out at once so requests don't queue behind each other
+            self.shard_executor = ThreadPoolExecutor(max_workers=search_workers * len(self.act_router.acts))
             
             # Create search prompt
             self.search_prompt = ChatPromptTemplate.from_messages([
@@ -64,12 +102,12 @@ class QueryAssistant:
                 Instructions:
                 1. Only analyze the Current Question
                 2. Use Previous Conversation for context only
-                3. Only cite BNS sections from Document Context
+                3. Only cite sections from Document Context, with the Act named as it appears there
                 4. Include Tamil Language translation
                 5. Include Hindi Language translation
                 
                 Provide:
-                1. Legal analysis with BNS Section X citations
+                1. Legal analysis with section citations (e.g. BNS Section X)
                 2. Draft petition if needed
                 3. Practical next steps
                 4. Tamil Language translation of the entire response
@@ -77,6 +115,43 @@ class QueryAssistant:
                  """)
             ])
             
+            # Create English-only and translation prompts for the pipeline response mode
+            self.english_prompt = ChatPromptTemplate.from_messages([
+                ("system", self.config["system_prompt"]),
+                ("user", """Use these inputs to provide a targeted response:
+
+                Previous Conversation Context (for reference only):
+                {conv_context}
+
+                Document Context:
+                {doc_context}
+                
+                Current Question: {query}
+                
+                Instructions:
+                1. Only analyze the Current Question
+                2. Use Previous Conversation for context only
+                3. Only cite sections from Document Context, with the Act named as it appears there
+                4. Respond in English only; translations are produced separately
+                
+                Provide:
+                1. Legal analysis with section citations (e.g. BNS Section X)
+                2. Draft petition if needed
+                3. Practical next steps
+                 """)
+            ])
+            
+            self.translation_prompt = ChatPromptTemplate.from_messages([
+                ("system", """You are a professional legal translator. Translate the legal response into {language}.
+                Guidelines:
+                - Translate the entire response
+                - Keep the structure, headings and formatting
+                - Keep section citations such as "BNS Section X" unchanged
+                - Return only the translation"""),
+                ("user", "{response}")
+            ])
+            
+            metrics.record_startup("query_assistant", time.perf_counter() - start)
             logger.info("Query Assistant initialized successfully")
             
         except Exception as e:
@@ -94,7 +169,385 @@ class QueryAssistant:
         
         return list(dict.fromkeys(phrases))  # Remove duplicates while preserving order
 
-    def process_query(self, query: str, chat_history: list, memory: dict) -> tuple:
+    def _get_cached_search_phrases(self, query: str) -> Optional[List[str]]:
+        """Get search phrases without the LLM, from local extraction or the phrase cache"""
+        extraction_config = self.config.get('phrase_extraction', {})
+        if extraction_config.get('mode', 'llm') == 'local':
+            return self.local_phrase_extractor.extract(query)
+        
+        if self.phrase_cache is not None:
+            cached = self.phrase_cache.get(normalize_query(query))
+            metrics.record_cache("phrase", int(cached is not None), int(cached is None))
+            logger.info(f"Phrase cache {'hit' if cached is not None else 'miss'}: {self.phrase_cache.stats.as_dict()}")
+            return cached
+        return None
+
+    def _handle_search_suggestions(self, query: str, search_suggestions: str) -> List[str]:
+        """Parse LLM search suggestions and cache the resulting phrases"""
+        search_phrases = self._extract_search_phrases(search_suggestions)
+        if self.phrase_cache is not None and search_phrases:
+            self.phrase_cache.put(normalize_query(query), search_phrases)
+        return search_phrases
+
+    def _handle_phrase_llm_error(self, query: str, error: Exception) -> List[str]:
+        """Fall back to local extraction when the phrase extraction LLM call fails"""
+        if self.local_phrase_extractor is None:
+            raise error
+        logger.warning(f"Phrase extraction LLM call failed, using local extraction: {str(error)}")
+        return self.local_phrase_extractor.extract(query)
+
+    def _request_search_phrases(self, query: str) -> List[str]:
+        """Ask the LLM for search phrases, falling back to local extraction on failure"""
+        try:
+            search_chain = self.search_prompt | self.llm | StrOutputParser()
+            with metrics.stage("phrase_llm"):
+                search_suggestions = search_chain.invoke({"query": query})
+        except Exception as e:
+            return self._handle_phrase_llm_error(query, e)
+        return self._handle_search_suggestions(query, search_suggestions)
+
+    async def _arequest_search_phrases(self, query: str) -> List[str]:
+        """Async variant of _request_search_phrases"""
+        loop = asyncio.get_running_loop()
+        try:
+            search_chain = self.search_prompt | self.llm | StrOutputParser()
+            with metrics.stage("phrase_llm"):
+                search_suggestions = await search_chain.ainvoke({"query": query})
+        except Exception as e:
+            return await loop.run_in_executor(self.executor, metrics.bind(self._handle_phrase_llm_error), query, e)
+        return self._handle_search_suggestions(query, search_suggestions)
+
+    @staticmethod
+    def _tag_results(act: Act, results: List[Dict]) -> List[Dict]:
+        """Mark results with their Act, since section numbers repeat across Acts"""
+        return [{**result, 'act': act.act_id, 'citation': act.citation} for result in results]
+    
+    def _candidate_k(self) -> int:
+        """Sections to retrieve, a wider pool when they are reranked afterwards"""
+        retrieval_config = self.config['retrieval']
+        if self.reranker is None:
+            return retrieval_config['k']
+        return max(retrieval_config.get('rerank', {}).get('candidates', 12), retrieval_config['k'])
+    
+    def _search_act(self, act: Act, search_phrases: List[str], citation_lookup: bool = True) -> List[Dict]:
+        """Search all phrases in a single batched query against one Act's collection"""
+        with metrics.stage("search", act=act.act_id, queries=len(search_phrases)):
+            all_results = self.vector_store.search_many(
+                collection_name=act.collection,
+                queries=search_phrases,
+                k=self._candidate_k(),
+                score_threshold=self.config['retrieval']['score_threshold'],
+                citation_lookup=citation_lookup
+            )
+        return self._tag_results(act, all_results[:self._candidate_k()])
+    
+    def _search(self, search_phrases: List[str], acts: List[Act], citation_lookup: bool = True) -> List[Dict]:
+        """Search the routed Acts in parallel and keep the top results across them"""
+        if len(acts) == 1:
+            return self._search_act(acts[0], search_phrases, citation_lookup)
+        futures = [
+            self.shard_executor.submit(metrics.bind(self._search_act), act, search_phrases, citation_lookup)
+            for act in acts
+        ]
+        return self._merge_results(*(future.result() for future in futures))
+    
+    @staticmethod
+    def _section_key(result: Dict) -> str:
+        return f"{result.get('citation', 'BNS')} {result['metadata']['section_num']}"
+    
+    def _merge_results(self, *result_lists: List[Dict]) -> List[Dict]:
+        """Merge result lists by Act and section number, keeping the best score, and keep the top results"""
+        merged = {}
+        for result in (result for results in result_lists for result in results):
+            key = self._section_key(result)
+            if key not in merged or result['score'] > merged[key]['score']:
+                merged[key] = result
+        return sorted(merged.values(), key=lambda x: x['score'], reverse=True)[:self._candidate_k()]
+    
+    def _rank(self, query: str, results: List[Dict]) -> List[Dict]:
+        """Keep the top k candidates, by cross-encoder score when reranking is enabled"""
+        if self.reranker is None:
+            return results[:self.config['retrieval']['k']]
+        return self.reranker.rerank(query, results, self.config['retrieval']['k'])
+    
+    def _speculative_config(self) -> Dict:
+        return self.config['retrieval'].get('speculative', {})
+    
+    def _speculative_queries(self, query: str, memory: Optional[Dict]) -> List[str]:
+        """The raw query, plus the query with recent user messages for follow-up questions"""
+        context_messages = self._speculative_config().get('context_messages', 1)
+        previous = [
+            message['content'] for message in (memory or {}).get('messages', [])
+            if message['role'] == 'user'
+        ][-context_messages:] if context_messages > 0 else []
+        queries = [query]
+        if previous:
+            queries.append(" ".join(previous + [query]))
+        return queries
+    
+    def _uncovered_phrases(self, search_phrases: List[str], speculative_queries: List[str]) -> List[str]:
+        """Phrases whose search the speculative queries have not already run"""
+        covered = {normalize_query(q) for q in speculative_queries}
+        return [phrase for phrase in search_phrases if normalize_query(phrase) not in covered]
+    
+    def _speculative_search(self, query: str, memory: Optional[Dict], acts: List[Act],
+                            search_phrases: Optional[List[str]] = None) -> List[Dict]:
+        """Search the raw query while the phrase extraction LLM call runs, then search only the new phrases.
+        Cached phrases skip the LLM call but are merged the same way, so results don't depend on the cache."""
+        queries = self._speculative_queries(query, memory)
+        citation_lookup = not self._cites_unregistered_acts(query)
+        speculative = self.executor.submit(metrics.bind(self._search), queries, acts, citation_lookup)
+        if search_phrases is None:
+            phrases = self.executor.submit(metrics.bind(self._request_search_phrases), query)
+            
+            timeout = self._speculative_config().get('timeout_seconds', 3.0)
+            try:
+                search_phrases = phrases.result(timeout=timeout)
+            except FutureTimeoutError:
+                # The call keeps running in the background and still fills the phrase cache
+                logger.warning(f"Phrase extraction took longer than {timeout}s, using speculative results")
+                metrics.annotate(phrase_extraction="timeout")
+                search_phrases = []
+            except Exception as e:
+                logger.warning(f"Phrase extraction failed, using speculative results: {str(e)}")
+                search_phrases = []
+        
+        remaining = self._uncovered_phrases(search_phrases, queries)
+        logger.info(f"Search phrases: {search_phrases}, {len(remaining)} not covered by speculative search")
+        results = self._search(remaining, acts, citation_lookup) if remaining else []
+        return self._merge_results(speculative.result(), results)
+    
+    async def _aspeculative_search(self, query: str, memory: Optional[Dict], acts: List[Act],
+                                   search_phrases: Optional[List[str]] = None) -> List[Dict]:
+        """Async variant of _speculative_search, cancelling the LLM call on timeout"""
+        loop = asyncio.get_running_loop()
+        queries = self._speculative_queries(query, memory)
+        citation_lookup = not self._cites_unregistered_acts(query)
+        speculative = loop.run_in_executor(self.executor, metrics.bind(self._search), queries, acts, citation_lookup)
+        if search_phrases is None:
+            timeout = self._speculative_config().get('timeout_seconds', 3.0)
+            try:
+                search_phrases = await asyncio.wait_for(self._arequest_search_phrases(query), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Phrase extraction took longer than {timeout}s, using speculative results")
+                metrics.annotate(phrase_extraction="timeout")
+                search_phrases = []
+            except Exception as e:
+                logger.warning(f"Phrase extraction failed, using speculative results: {str(e)}")
+                search_phrases = []
+        
+        remaining = self._uncovered_phrases(search_phrases, queries)
+        logger.info(f"Search phrases: {search_phrases}, {len(remaining)} not covered by speculative search")
+        results = await loop.run_in_executor(
+            self.executor, metrics.bind(self._search), remaining, acts, citation_lookup
+        ) if remaining else []
+        return self._merge_results(await speculative, results)
+
+    def _cites_unregistered_acts(self, query: str) -> bool:
+        """Whether the query cites sections of an Act that is not indexed, whose numbers must not be looked up"""
+        return any(
+            act_name and self.act_router.act_for_citation(act_name) is None
+            for act_name, _ in extract_section_citations(query)
+        )
+    
+    def _get_cited_sections(self, query: str, acts: List[Act]) -> List[Dict]:
+        """Fetch sections cited directly in the query, bypassing phrase extraction and search"""
+        retrieval_config = self.config['retrieval']
+        if not retrieval_config.get('citation_fast_path', True):
+            return []
+        
+        citations = extract_section_citations(query)[:retrieval_config.get('max_cited_sections', 10)]
+        if not citations:
+            return []
+        
+        # "section 302 IPC" is not BNS 302, sections of Acts that are not indexed are left to search
+        if self._cites_unregistered_acts(query):
+            logger.info(f"Query cites sections of unregistered Acts {citations}, searching instead")
+            return []
+        
+        # Each number is fetched from the Act it names, numbers naming none from the one Act the query is about
+        targets: Dict[str, Tuple[Act, List[str]]] = {}
+        unqualified = [number for act_name, number in citations if act_name is None]
+        for act_name, number in citations:
+            if act_name is not None:
+                act = self.act_router.act_for_citation(act_name)
+                targets.setdefault(act.act_id, (act, []))[1].append(number)
+        if unqualified:
+            candidates = self.act_router.route(strip_qualified_citations(query)) if targets else acts
+            if len(candidates) == 1:
+                targets.setdefault(candidates[0].act_id, (candidates[0], []))[1].extend(unqualified)
+            else:
+                logger.info(f"Sections {unqualified} could be in any of {[act.act_id for act in candidates]}, leaving them to search")
+                if not targets:
+                    return []
+        
+        results = [
+            result for act, section_nums in targets.values()
+            for result in self._tag_results(act, self.vector_store.get_sections(act.collection, list(dict.fromkeys(section_nums))))
+        ]
+        logger.info(f"Cited sections {citations}, found {len(results)}")
+        return results
+
+    def _route(self, query: str) -> List[Act]:
+        acts = self.act_router.route(query)
+        metrics.annotate(acts=[act.act_id for act in acts])
+        return acts
+    
+    def _retrieve(self, query: str, memory: dict) -> Tuple[Dict, List[Dict]]:
+        """Retrieve relevant sections and build the response chain inputs within the token budget"""
+        acts = self._route(query)
+        results = self._get_cited_sections(query, acts)
+        if results:
+            return self.context_builder.build(query, memory, results)
+        
+        # Cached phrases still go through the speculative merge, or results would depend on the phrase cache
+        search_phrases = self._get_cached_search_phrases(query)
+        if self._speculative_config().get('enabled', False):
+            results = self._rank(query, self._speculative_search(query, memory, acts, search_phrases))
+            return self.context_builder.build(query, memory, results)
+        
+        if search_phrases is None:
+            search_phrases = self._request_search_phrases(query)
+        logger.info(f"Search phrases: {search_phrases}")
+        
+        results = self._rank(query, self._search(search_phrases, acts, not self._cites_unregistered_acts(query)))
+        return self.context_builder.build(query, memory, results)
+
+    async def _aretrieve(self, query: str, memory: dict) -> Tuple[Dict, List[Dict]]:
+        """Async variant of _retrieve, running vector searches and token counting in the executor"""
+        loop = asyncio.get_running_loop()
+        acts = self._route(query)
+        results = await loop.run_in_executor(self.executor, metrics.bind(self._get_cited_sections), query, acts)
+        if not results:
+            search_phrases = await loop.run_in_executor(self.executor, metrics.bind(self._get_cached_search_phrases), query)
+            if self._speculative_config().get('enabled', False):
+                results = await self._aspeculative_search(query, memory, acts, search_phrases)
+            else:
+                if search_phrases is None:
+                    search_phrases = await self._arequest_search_phrases(query)
+                logger.info(f"Search phrases: {search_phrases}")
+                results = await loop.run_in_executor(
+                    self.executor, metrics.bind(self._search), search_phrases, acts, not self._cites_unregistered_acts(query)
+                )
+            results = await loop.run_in_executor(self.executor, metrics.bind(self._rank), query, results)
+        
+        return await loop.run_in_executor(self.executor, metrics.bind(self.context_builder.build), query, memory, results)
+
+    def _lookup_cached_response(self, query: str, results: List[Dict], languages: Optional[List[str]] = None,
+                                conv_context: str = "") -> Tuple[Optional[str], Optional[List[float]]]:
+        """Reuse a cached answer for a near-identical query over the same sections in the same conversation"""
+        if self.response_cache is None:
+            return None, None
+        
+        query_embedding = self.embedding_function.get_embeddings([query])[0]
+        section_nums = [self._section_key(r) for r in results]
+        response = self.response_cache.lookup(query_embedding, section_nums, self._cache_variant(languages, conv_context))
+        metrics.record_cache("response", int(response is not None), int(response is None))
+        logger.info(f"Response cache {'hit' if response else 'miss'}: {self.response_cache.stats.as_dict()}")
+        return response, query_embedding
+
+    def _store_cached_response(self, query: str, query_embedding: Optional[List[float]], results: List[Dict],
+                               response: str, languages: Optional[List[str]] = None, conv_context: str = "") -> None:
+        """Store a generated answer in the response cache"""
+        if self.response_cache is not None and query_embedding is not None:
+            section_nums = [self._section_key(r) for r in results]
+            self.response_cache.store(query, query_embedding, section_nums, response,
+                                      self._cache_variant(languages, conv_context))
+    
+    @staticmethod
+    def _cache_variant(languages: Optional[List[str]], conv_context: str = "") -> str:
+        """Distinguish cached answers by the translations they contain and the conversation they were generated in"""
+        # Follow-ups depend on, and may quote, earlier turns, so an answer is only reused under the same history.
+        # Entries cached before the history was part of the key have no history marker and never match.
+        history = "none"
+        if conv_context.strip():
+            history = hashlib.sha256(normalize_query(conv_context).encode('utf-8')).hexdigest()[:32]
+        pipeline = "" if languages is None else "pipeline:" + ",".join(languages) + "|"
+        return f"{pipeline}history:{history}"
+
+    def _response_languages(self, languages: Optional[List[str]]) -> Optional[List[str]]:
+        """Languages to translate into in pipeline mode, or None for single-call mode"""
+        response_config = self.config.get('response', {})
+        if response_config.get('mode', 'single') != 'pipeline':
+            return None
+        return list(languages if languages is not None else response_config.get('languages', []))
+
+    @staticmethod
+    def _translation_header(language: str) -> str:
+        return f"\n\n---\n\n## {language} Translation\n\n"
+
+    def _generate_pipeline(self, chain_inputs: Dict, languages: List[str]) -> str:
+        """Generate the English answer, then all translations concurrently"""
+        english_chain = self.english_prompt | self.llm | StrOutputParser()
+        response = english_chain.invoke(chain_inputs)
+        if not languages:
+            return response
+        
+        translation_chain = self.translation_prompt | self.llm | StrOutputParser()
+        translations = translation_chain.batch([
+            {"language": language, "response": response} for language in languages
+        ])
+        return response + "".join(
+            self._translation_header(language) + translation
+            for language, translation in zip(languages, translations)
+        )
+
+    def _stream_pipeline(self, chain_inputs: Dict, languages: List[str]) -> Iterator[str]:
+        """Stream the English answer, then each translation in order as soon as it is ready"""
+        english_chain = self.english_prompt | self.llm | StrOutputParser()
+        response = ""
+        for token in english_chain.stream(chain_inputs):
+            response += token
+            yield token
+        
+        translation_chain = self.translation_prompt | self.llm | StrOutputParser()
+        futures = [
+            self.executor.submit(metrics.bind(translation_chain.invoke), {"language": language, "response": response})
+            for language in languages
+        ]
+        for language, future in zip(languages, futures):
+            yield self._translation_header(language) + future.result()
+
+    async def _agenerate_pipeline(self, chain_inputs: Dict, languages: List[str]) -> str:
+        """Async variant of _generate_pipeline"""
+        return "".join([piece async for piece in self._astream_pipeline(chain_inputs, languages, stream_english=False)])
+
+    async def _astream_pipeline(self, chain_inputs: Dict, languages: List[str], stream_english: bool = True) -> AsyncIterator[str]:
+        """Async variant of _stream_pipeline"""
+        english_chain = self.english_prompt | self.llm | StrOutputParser()
+        if stream_english:
+            response = ""
+            async for token in english_chain.astream(chain_inputs):
+                response += token
+                yield token
+        else:
+            response = await english_chain.ainvoke(chain_inputs)
+            yield response
+        
+        translation_chain = self.translation_prompt | self.llm | StrOutputParser()
+        tasks = [
+            asyncio.ensure_future(translation_chain.ainvoke({"language": language, "response": response}))
+            for language in languages
+        ]
+        try:
+            for language, task in zip(languages, tasks):
+                yield self._translation_header(language) + await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _commit_exchange(query: str, response: str, chat_history: list, memory: dict) -> None:
+        """Add a completed exchange to chat history and memory"""
+        chat_history.append({"role": "user", "content": query})
+        chat_history.append({"role": "assistant", "content": response})
+        memory["messages"].extend([
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": response}
+        ])
+
+    @metrics.traced("sync")
+    def process_query(self, query: str, chat_history: list, memory: dict, languages: Optional[List[str]] = None) -> tuple:
         """Process query with conversation memory"""
         try:
             if not memory:
@@ -103,70 +556,185 @@ class QueryAssistant:
             # Handle simple context questions
             if is_simple_context_question(query, memory):
                 response = get_simple_context_answer(query, memory)
-                chat_history.append({"role": "user", "content": query})
-                chat_history.append({"role": "assistant", "content": response})
-                memory["messages"].extend([
-                    {"role": "user", "content": query},
-                    {"role": "assistant", "content": response}
-                ])
+                self._commit_exchange(query, response, chat_history, memory)
                 return "", chat_history, memory
             
-            # Get conversation context
-            conv_context = get_conversation_context(memory)
-            logger.info(f"Conversation context:\n{conv_context}")
-            
-            # Generate search phrases
-            search_chain = self.search_prompt | self.llm | StrOutputParser()
-            search_suggestions = search_chain.invoke({"query": query})
-            search_phrases = self._extract_search_phrases(search_suggestions)
-            logger.info(f"Search phrases: {search_phrases}")
-            
-            # Search for each phrase
-            all_results = {}
-            for phrase in search_phrases:
-                results = self.vector_store.search(
-                    collection_name="bns_sections",
-                    query=phrase,
-                    k=self.config['retrieval']['k'],
-                    score_threshold=self.config['retrieval']['score_threshold']
-                )
-                
-                for result in results:
-                    section_num = result['metadata']['section_num']
-                    if section_num not in all_results or result['score'] > all_results[section_num]['score']:
-                        all_results[section_num] = result
-            
-            # Combine and sort results
-            combined_results = sorted(
-                all_results.values(), 
-                key=lambda x: x['score'], 
-                reverse=True
-            )[:self.config['retrieval']['k']]
-            
-            # Build context from results
-            doc_context = "\n\n".join([
-                f"BNS Section {r['metadata']['section_num']}: {r['metadata']['title']}\n{r['content']}"
-                for r in combined_results
-            ])
+            languages = self._response_languages(languages)
+            chain_inputs, results = self._retrieve(query, memory)
+            response, query_embedding = self._lookup_cached_response(query, results, languages, chain_inputs['conv_context'])
             
             # Generate response
-            chain = self.response_prompt | self.llm | StrOutputParser()
-            response = chain.invoke({
-                "query": query,
-                "conv_context": conv_context,
-                "doc_context": doc_context
-            })
+            if response is None:
+                with metrics.stage("response_llm"):
+                    if languages is None:
+                        chain = self.response_prompt | self.llm | StrOutputParser()
+                        response = chain.invoke(chain_inputs)
+                    else:
+                        response = self._generate_pipeline(chain_inputs, languages)
+                self._store_cached_response(query, query_embedding, results, response, languages,
+                                            chain_inputs['conv_context'])
             
             # Update chat history and memory
+            self._commit_exchange(query, response, chat_history, memory)
+            
+            return "", chat_history, memory
+            
+        except Exception as e:
+            logger.error(f"Error processing query: {str(e)}")
+            metrics.fail(e)
+            return handle_error_response(query, chat_history, memory, user_error_message(e))
+
+    @metrics.traced("stream")
+    def process_query_stream(self, query: str, chat_history: list, memory: dict,
+                             languages: Optional[List[str]] = None) -> Iterator[tuple]:
+        """Process query, yielding partial chat history as response tokens arrive"""
+        history_length = len(chat_history)
+        try:
+            if not memory:
+                memory = {"session_id": datetime.now().strftime('%Y%m%d_%H%M%S'), "messages": []}
+            
+            # Handle simple context questions
+            if is_simple_context_question(query, memory):
+                response = get_simple_context_answer(query, memory)
+                self._commit_exchange(query, response, chat_history, memory)
+                yield "", chat_history, memory
+                return
+            
+            languages = self._response_languages(languages)
+            chain_inputs, results = self._retrieve(query, memory)
+            response, query_embedding = self._lookup_cached_response(query, results, languages, chain_inputs['conv_context'])
+            if response is not None:
+                self._commit_exchange(query, response, chat_history, memory)
+                yield "", chat_history, memory
+                return
+            
+            # Stream tokens into a placeholder message
             chat_history.append({"role": "user", "content": query})
-            chat_history.append({"role": "assistant", "content": response})
+            chat_history.append({"role": "assistant", "content": ""})
+            yield "", chat_history, memory
+            
+            if languages is None:
+                chain = self.response_prompt | self.llm | StrOutputParser()
+                tokens = chain.stream(chain_inputs)
+            else:
+                tokens = self._stream_pipeline(chain_inputs, languages)
+            for token in metrics.timed_iter(tokens, "response_llm"):
+                chat_history[-1]["content"] += token
+                yield "", chat_history, memory
+            
+            # Commit to memory only once the full response exists
+            response = chat_history[-1]["content"]
             memory["messages"].extend([
                 {"role": "user", "content": query},
                 {"role": "assistant", "content": response}
             ])
-            
-            return "", chat_history, memory
+            self._store_cached_response(query, query_embedding, results, response, languages,
+                                        chain_inputs['conv_context'])
+            yield "", chat_history, memory
             
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
-            return handle_error_response(query, chat_history, memory)
\ No newline at end of file
+            metrics.fail(e)
+            del chat_history[history_length:]
+            yield handle_error_response(query, chat_history, memory, user_error_message(e))
+
+    @metrics.traced("async")
+    async def aprocess_query(self, query: str, chat_history: list, memory: dict,
+                             languages: Optional[List[str]] = None) -> tuple:
+        """Async variant of process_query"""
+        async with self.request_semaphore:
+            try:
+                if not memory:
+                    memory = {"session_id": datetime.now().strftime('%Y%m%d_%H%M%S'), "messages": []}
+                
+                # Handle simple context questions
+                if is_simple_context_question(query, memory):
+                    response = get_simple_context_answer(query, memory)
+                    self._commit_exchange(query, response, chat_history, memory)
+                    return "", chat_history, memory
+                
+                languages = self._response_languages(languages)
+                loop = asyncio.get_running_loop()
+                chain_inputs, results = await self._aretrieve(query, memory)
+                response, query_embedding = await loop.run_in_executor(
+                    self.executor, metrics.bind(self._lookup_cached_response), query, results, languages,
+                    chain_inputs['conv_context']
+                )
+                
+                # Generate response
+                if response is None:
+                    with metrics.stage("response_llm"):
+                        if languages is None:
+                            chain = self.response_prompt | self.llm | StrOutputParser()
+                            response = await chain.ainvoke(chain_inputs)
+                        else:
+                            response = await self._agenerate_pipeline(chain_inputs, languages)
+                    self._store_cached_response(query, query_embedding, results, response, languages,
+                                                chain_inputs['conv_context'])
+                
+                self._commit_exchange(query, response, chat_history, memory)
+                return "", chat_history, memory
+                
+            except Exception as e:
+                logger.error(f"Error processing query: {str(e)}")
+                metrics.fail(e)
+                return handle_error_response(query, chat_history, memory, user_error_message(e))
+
+    @metrics.traced("async_stream")
+    async def aprocess_query_stream(self, query: str, chat_history: list, memory: dict,
+                                    languages: Optional[List[str]] = None) -> AsyncIterator[tuple]:
+        """Async variant of process_query_stream"""
+        history_length = len(chat_history)
+        async with self.request_semaphore:
+            try:
+                if not memory:
+                    memory = {"session_id": datetime.now().strftime('%Y%m%d_%H%M%S'), "messages": []}
+                
+                # Handle simple context questions
+                if is_simple_context_question(query, memory):
+                    response = get_simple_context_answer(query, memory)
+                    self._commit_exchange(query, response, chat_history, memory)
+                    yield "", chat_history, memory
+                    return
+                
+                languages = self._response_languages(languages)
+                loop = asyncio.get_running_loop()
+                chain_inputs, results = await self._aretrieve(query, memory)
+                response, query_embedding = await loop.run_in_executor(
+                    self.executor, metrics.bind(self._lookup_cached_response), query, results, languages,
+                    chain_inputs['conv_context']
+                )
+                if response is not None:
+                    self._commit_exchange(query, response, chat_history, memory)
+                    yield "", chat_history, memory
+                    return
+                
+                # Stream tokens into a placeholder message
+                chat_history.append({"role": "user", "content": query})
+                chat_history.append({"role": "assistant", "content": ""})
+                yield "", chat_history, memory
+                
+                if languages is None:
+                    chain = self.response_prompt | self.llm | StrOutputParser()
+                    tokens = chain.astream(chain_inputs)
+                else:
+                    tokens = self._astream_pipeline(chain_inputs, languages)
+                async for token in metrics.atimed_iter(tokens, "response_llm"):
+                    chat_history[-1]["content"] += token
+                    yield "", chat_history, memory
+                
+                # Commit to memory only once the full response exists
+                response = chat_history[-1]["content"]
+                memory["messages"].extend([
+                    {"role": "user", "content": query},
+                    {"role": "assistant", "content": response}
+                ])
+                self._store_cached_response(query, query_embedding, results, response, languages,
+                                            chain_inputs['conv_context'])
+                yield "", chat_history, memory
+                
+            except Exception as e:
+                logger.error(f"Error processing query: {str(e)}")
+                metrics.fail(e)
+                del chat_history[history_length:]
+                yield handle_error_response(query, chat_history, memory, user_error_message(e))
\ No newline at end of file
@@ -0,0 +1,106 @@
+# reranker.py
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from cache import LRUCache
+from utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str, device: str = "cpu", batch_size: int = 16, max_length: int = 512,
+                 latency_budget_ms: float = 300, cache_size: int = 10000, warmup: bool = True,
+                 reprobe_seconds: float = 60):
+        """Rescore retrieved sections against the query with a cross-encoder"""
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.latency_budget_ms = latency_budget_ms
+        self.reprobe_seconds = reprobe_seconds
+        self.cache = LRUCache(max_entries=cache_size) if cache_size > 0 else None
+        # Running estimate of scoring time per pair, used to enforce the latency budget
+        self.pair_ms: Optional[float] = None
+        self._measured_at = time.monotonic()
+        self._lock = threading.Lock()
+        
+        start = time.perf_counter()
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+        if warmup:
+            # The first call pays one-off setup costs, the estimate comes from pairs as long as real sections
+            self.model.predict([("warmup", "warmup")], show_progress_bar=False)
+            section = " ".join(["section"] * max_length)
+            self._score([("what is the punishment for this offence", section)] * batch_size)
+        metrics.record_startup("reranker", time.perf_counter() - start)
+
+    @staticmethod
+    def section_text(result: Dict) -> str:
+        return f"{result['metadata'].get('title', '')}\n{result['content']}"
+
+    def _key(self, query: str, result: Dict) -> str:
+        text = f"{self.model_name}\n{normalize_query(query)}\n{self.section_text(result)}"
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _score(self, pairs: List[Tuple[str, str]], probe: bool = False) -> List[float]:
+        """Score all pairs in one predict call and update the per-pair latency estimate, replacing it on a probe"""
+        start = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        elapsed = time.perf_counter() - start
+        metrics.record_stage("rerank", elapsed, pairs=len(pairs))
+        pair_ms = elapsed * 1000 / len(pairs)
+        with self._lock:
+            self.pair_ms = pair_ms if self.pair_ms is None or probe else 0.8 * self.pair_ms + 0.2 * pair_ms
+            self._measured_at = time.monotonic()
+        return [float(score) for score in scores]
+    
+    def _claim_probe(self) -> bool:
+        """Whether this request should score despite the estimate, since skipping never measures a recovery"""
+        if not self.reprobe_seconds:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._measured_at < self.reprobe_seconds:
+                return False
+            # Claimed by this request, concurrent ones keep skipping
+            self._measured_at = now
+            return True
+
+    def rerank(self, query: str, results: List[Dict], k: int) -> List[Dict]:
+        """Order results by cross-encoder score and keep the top k, keeping retrieval order if scoring would exceed the budget"""
+        if len(results) <= 1:
+            return results[:k]
+
+        keys = [self._key(query, result) for result in results]
+        scores = [self.cache.get(key) if self.cache is not None else None for key in keys]
+        missing = [idx for idx, score in enumerate(scores) if score is None]
+        if self.cache is not None:
+            metrics.record_cache("rerank", len(results) - len(missing), len(missing))
+        if missing:
+            estimate_ms = len(missing) * (self.pair_ms or 0)
+            probe = False
+            if self.latency_budget_ms and estimate_ms > self.latency_budget_ms:
+                probe = self._claim_probe()
+                if not probe:
+                    logger.warning(
+                        f"Skipping rerank, {len(missing)} pairs would take about {estimate_ms:.0f} ms "
+                        f"(budget {self.latency_budget_ms} ms)"
+                    )
+                    return results[:k]
+                logger.info(f"Re-measuring rerank latency, last estimate is over {self.reprobe_seconds}s old")
+            
+            computed = self._score([(query, self.section_text(results[idx])) for idx in missing], probe=probe)
+            for idx, score in zip(missing, computed):
+                scores[idx] = score
+                if self.cache is not None:
+                    self.cache.put(keys[idx], score)
+
+        # The retrieval score is kept for reference, the context builder drops sections by rerank score
+        reranked = [{**result, 'retrieval_score': result['score'], 'score': score} for result, score in zip(results, scores)]
+        reranked.sort(key=lambda x: x['score'], reverse=True)
+        logger.info(f"Reranked {len(results)} sections, {len(missing)} scored, {len(results) - len(missing)} cached")
+        return reranked[:k]
@@ -0,0 +1,108 @@
+# sparse_index.py
+
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "as", "at", "be", "by", "for", "from", "has", "have", "he", "his",
+    "in", "is", "it", "its", "of", "on", "or", "shall", "such", "that", "the", "this", "to", "which",
+    "who", "whoever", "with"
+}
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    def __init__(self, ids: List[str], vocab: Dict[str, int], offsets: np.ndarray, postings_docs: np.ndarray,
+                 postings_tfs: np.ndarray, doc_lengths: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        """BM25 over an inverted index stored as CSR arrays (term -> documents, term frequencies)"""
+        self.ids = ids
+        self.vocab = vocab
+        self.offsets = offsets
+        self.postings_docs = postings_docs
+        self.postings_tfs = postings_tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, ids: List[str], texts: List[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Build the index from document texts"""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_idx, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_idx] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_idx, tf))
+
+        terms = sorted(postings)
+        vocab = {term: idx for idx, term in enumerate(terms)}
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for idx, term in enumerate(terms):
+            offsets[idx + 1] = offsets[idx] + len(postings[term])
+        postings_docs = np.fromiter((doc for term in terms for doc, _ in postings[term]), dtype=np.int32, count=int(offsets[-1]))
+        postings_tfs = np.fromiter((tf for term in terms for _, tf in postings[term]), dtype=np.float32, count=int(offsets[-1]))
+
+        return cls(list(ids), vocab, offsets, postings_docs, postings_tfs, doc_lengths, k1, b)
+
+    def save(self, directory: str) -> None:
+        """Persist arrays as .npy files so they can be memory-mapped on load"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "postings_docs.npy"), self.postings_docs)
+        np.save(os.path.join(directory, "postings_tfs.npy"), self.postings_tfs)
+        np.save(os.path.join(directory, "doc_lengths.npy"), self.doc_lengths)
+        with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "vocab": self.vocab, "k1": self.k1, "b": self.b}, f)
+        logger.info(f"Saved BM25 index with {len(self.ids)} documents and {len(self.vocab)} terms to {directory}")
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        """Load a persisted index with memory-mapped arrays"""
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in ("offsets", "postings_docs", "postings_tfs", "doc_lengths")
+        }
+        return cls(data["ids"], data["vocab"], k1=data["k1"], b=data["b"], **arrays)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, "index.json"))
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Return the top k (document id, BM25 score) pairs"""
+        num_docs = len(self.ids)
+        if not num_docs:
+            return []
+
+        scores = np.zeros(num_docs, dtype=np.float32)
+        length_norm = self.k1 * (1 - self.b + self.b * np.asarray(self.doc_lengths) / max(self.avg_doc_length, 1e-9))
+        for term in set(tokenize(query)):
+            term_idx = self.vocab.get(term)
+            if term_idx is None:
+                continue
+            start, end = int(self.offsets[term_idx]), int(self.offsets[term_idx + 1])
+            docs = np.asarray(self.postings_docs[start:end])
+            tfs = np.asarray(self.postings_tfs[start:end])
+            df = end - start
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + length_norm[docs])
+
+        k = min(k, num_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[idx], float(scores[idx])) for idx in top if scores[idx] > 0]
@@ -1,89 +1,224 @@
 # text_processor.py
 
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
 import re
 import PyPDF2
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Precompiled patterns for section parsing
+CHAPTER_PATTERN = re.compile(r'^CHAPTER\b')
+# Sections inserted or substituted by amendments start with their footnote number, as in "3[185. Loans to directors"
+SECTION_PATTERN = re.compile(r'^(?:\d+\[)?(\d+[A-Z]{0,3})\s*\.\s*(.*?)\s*\.\s*[—–-]+\s*')
+SECTION_START_PATTERN = re.compile(r'^(?:\d+\[)?\d+[A-Z]{0,3}\s*\.\s*\[?\s*[A-Z]')
+# Repealed sections keep their number, as in "11. [Commencement of business, etc.] Omitted by ..."
+OMITTED_SECTION_PATTERN = re.compile(r'^(\d+[A-Z]{0,3})\s*\.\s*\[\s*(.*?)\s*\.?\s*\]\s*(?=Omitted\b)')
+EXPLANATION_PATTERN = re.compile(r'^Explanation\s*\d*\s*\.?\s*[—–]+\s*')
+ILLUSTRATION_PATTERN = re.compile(r'^Illustrations?\.?$')
+CLAUSE_PATTERN = re.compile(r'^\(\s*(\d+|[a-z]{1,5})\s*\)\s*')
+PAGE_NUMBER_PATTERN = re.compile(r'^\d+$')
+PART_PATTERN = re.compile(r'^PART\s+[IVXLC]+\b')
+# Amendment footnotes at the foot of a page, as in "1. Subs. by Act 1 of 2018, s. 2, for clause (28) (w.e.f. 9-2-2018)."
+FOOTNOTE_PATTERN = re.compile(r'^\d+\.\s')
+AMENDMENT_PATTERN = re.compile(
+    r'w\.\s*e\.\s*f\.|\bibid\b|\b(?:Subs|Ins)\.\s*by\b|\bomitted\s+by\b|\bby\s+(?:Act\s+\d+\s+of\s+\d{4}|s\.\s*\d+|S\.\s*O\.|G\.\s*S\.\s*R\.)',
+    re.IGNORECASE
+)
+# Schedules follow the last section and number their own paragraphs
+SCHEDULE_PATTERN = re.compile(r'^(?:THE\s+\w+\s+)?S\s*C\s*H\s*E\s*D\s*U\s*L\s*E\b')
+PAGE_BREAK = '\f'
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract text of pages [start, end) in a worker process"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() for i in range(start, end)]
+
 class TextProcessor:
-    def __init__(self, chunk_size: int = 256, chunk_overlap: int = 25):
+    def __init__(self, chunk_size: int = 256, chunk_overlap: int = 25, pdf_workers: int = 1):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.pdf_workers = pdf_workers
     
-    def read_pdf(self, file_path: str) -> str:
-        """Read text from PDF file"""
+    def iter_pdf_pages(self, file_path: str, workers: Optional[int] = None) -> Iterator[str]:
+        """Yield the text of each PDF page in order as soon as it is extracted"""
+        workers = self.pdf_workers if workers is None else workers
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        
         try:
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+                num_pages = len(pdf_reader.pages)
+                if workers == 1 or num_pages < 2 * workers:
+                    for page in pdf_reader.pages:
+                        yield page.extract_text()
+                    return
+            
+            # Shard page ranges across a process pool, several shards per worker to balance load
+            shard_size = math.ceil(num_pages / (workers * 4))
+            starts = range(0, num_pages, shard_size)
+            ends = [min(start + shard_size, num_pages) for start in starts]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for pages in executor.map(_extract_page_range, [file_path] * len(starts), starts, ends):
+                    yield from pages
         except Exception as e:
             logger.error(f"Error reading PDF: {str(e)}")
             raise
     
+    def read_pdf(self, file_path: str, workers: Optional[int] = None) -> str:
+        """Read text from PDF file"""
+        return "".join(page + "\n" for page in self.iter_pdf_pages(file_path, workers))
+    
     def process_text(self, text: str) -> List[Dict]:
         """Process text into structured sections"""
+        return list(self.iter_sections([text]))
+    
+    def iter_sections(self, pages: Iterable[str]) -> Iterator[Dict]:
+        """Parse an iterator of pages or lines, yielding each section as soon as it closes"""
         try:
-            sections = []
             current_chapter = ""
-            
-            # Split text into lines
-            lines = text.split('\n')
-            
-            # Patterns
-            section_pattern = r'(\d+)\.\s*(.*?)\s*\.—'
+            current_chapter_title = ""
+            expecting_chapter_title = False
             current_section = None
-            current_title = ""
-            current_content = []
+            pending_line = None
+            in_footnotes = False
             
-            for line in lines:
+            for line in self._iter_lines(pages):
+                # Footnotes run to the end of the page
+                if line == PAGE_BREAK:
+                    in_footnotes = False
+                    continue
                 line = line.strip()
-                if not line:
+                if PAGE_NUMBER_PATTERN.match(line):
+                    in_footnotes = False
+                    continue
+                if not line or in_footnotes:
                     continue
+                if (FOOTNOTE_PATTERN.match(line) and AMENDMENT_PATTERN.search(line)
+                        and not OMITTED_SECTION_PATTERN.match(line)):
+                    in_footnotes = True
+                    continue
+                if current_section and SCHEDULE_PATTERN.match(line):
+                    break
                 
                 # Check for chapter
-                if line.startswith('CHAPTER'):
+                if CHAPTER_PATTERN.match(line):
+                    if pending_line is not None and current_section:
+                        self._add_section_line(current_section, pending_line)
+                    pending_line = None
+                    if current_section:
+                        yield self._finish_section(current_section)
+                        current_section = None
                     current_chapter = line
+                    current_chapter_title = ""
+                    expecting_chapter_title = True
                     continue
                 
+                # Section titles may wrap onto the next line
+                if pending_line is not None:
+                    combined = f"{pending_line} {line}"
+                    is_heading = SECTION_PATTERN.match(combined) or OMITTED_SECTION_PATTERN.match(combined)
+                    if is_heading and not (EXPLANATION_PATTERN.match(line) or PART_PATTERN.match(line)):
+                        line = combined
+                    elif current_section:
+                        self._add_section_line(current_section, pending_line)
+                    pending_line = None
+                
                 # Check for new section
-                match = re.match(section_pattern, line)
+                match = SECTION_PATTERN.match(line) or OMITTED_SECTION_PATTERN.match(line)
+                
+                # Chapter heading follows the chapter line
+                if expecting_chapter_title:
+                    expecting_chapter_title = False
+                    if not match:
+                        current_chapter_title = line
+                        continue
                 if match:
-                    # Save previous section
                     if current_section:
-                        sections.append({
-                            'section_num': current_section,
-                            'title': current_title,
-                            'content': ' '.join(current_content),
-                            'chapter': current_chapter
-                        })
-                    
-                    # Start new section
-                    current_section = match.group(1)
-                    current_title = match.group(2)
-                    current_content = []
+                        yield self._finish_section(current_section)
+                    current_section = {
+                        'section_num': match.group(1),
+                        'title': match.group(2),
+                        'chapter': current_chapter,
+                        'chapter_title': current_chapter_title,
+                        'lines': [],
+                        'sub_clauses': [],
+                        'explanations': [],
+                        'illustrations': [],
+                        'mode': 'body'
+                    }
+                    remainder = line[match.end():].strip()
+                    if remainder:
+                        self._add_section_line(current_section, remainder)
+                elif SECTION_START_PATTERN.match(line) and '—' not in line:
+                    pending_line = line
                 elif current_section:
-                    current_content.append(line)
+                    self._add_section_line(current_section, line)
             
             # Add last section
+            if pending_line is not None and current_section:
+                self._add_section_line(current_section, pending_line)
             if current_section:
-                sections.append({
-                    'section_num': current_section,
-                    'title': current_title,
-                    'content': ' '.join(current_content),
-                    'chapter': current_chapter
-                })
-            
-            return sections
+                yield self._finish_section(current_section)
             
         except Exception as e:
             logger.error(f"Error processing text: {str(e)}")
             raise
     
+    @staticmethod
+    def _iter_lines(pages: Iterable[str]) -> Iterator[str]:
+        for page in pages:
+            yield from page.split('\n')
+            yield PAGE_BREAK
+    
+    @staticmethod
+    def _add_section_line(section: Dict, line: str) -> None:
+        """Add a line to a section, tracking sub-clauses, explanations and illustrations"""
+        section['lines'].append(line)
+        
+        explanation = EXPLANATION_PATTERN.match(line)
+        if explanation:
+            section['mode'] = 'explanation'
+            section['explanations'].append(line[explanation.end():])
+            return
+        if ILLUSTRATION_PATTERN.match(line.replace(' ', '')):
+            section['mode'] = 'illustration'
+            return
+        
+        clause = CLAUSE_PATTERN.match(line)
+        if clause and clause.group(1).isdigit():
+            section['mode'] = 'body'
+        
+        if section['mode'] == 'illustration':
+            if clause or not section['illustrations']:
+                section['illustrations'].append(line)
+            else:
+                section['illustrations'][-1] += ' ' + line
+        elif section['mode'] == 'explanation':
+            section['explanations'][-1] += ' ' + line
+        elif clause:
+            section['sub_clauses'].append({'label': clause.group(1), 'text': line[clause.end():]})
+        elif section['sub_clauses']:
+            section['sub_clauses'][-1]['text'] += ' ' + line
+    
+    @staticmethod
+    def _finish_section(section: Dict) -> Dict:
+        return {
+            'section_num': section['section_num'],
+            'title': section['title'],
+            'content': ' '.join(section['lines']),
+            'chapter': section['chapter'],
+            'chapter_title': section['chapter_title'],
+            'sub_clauses': section['sub_clauses'],
+            'explanations': [text.strip() for text in section['explanations']],
+            'illustrations': section['illustrations']
+        }
+    
     def chunk_text(self, text: str) -> List[str]:
         """Split text into chunks with overlap"""
         words = text.split()
@@ -92,5 +227,16 @@ class TextProcessor:
         for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
             chunk = ' '.join(words[i:i + self.chunk_size])
             chunks.append(chunk)
+            # Stop once the text end is covered so no chunk is only overlap
+            if i + self.chunk_size >= len(words):
+                break
         
-        return chunks
\ No newline at end of file
+        return chunks
+    
+    def chunk_section(self, section: Dict) -> List[Dict]:
+        """Split a section into overlapping chunks that keep its metadata"""
+        chunks = self.chunk_text(section['content']) or ['']
+        return [
+            {**section, 'content': chunk, 'chunk_index': i}
+            for i, chunk in enumerate(chunks)
+        ]
\ No newline at end of file
@@ -1,7 +1,8 @@
 # utils.py
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +35,60 @@ def get_conversation_context(memory_dict: Dict) -> str:
     ])
     return context
 
+# "s." must not be the end of an abbreviation such as "U.S."
+SECTION_WORD = r'(?:sections?|secs?\.?|(?<![\w.])ss?\.)'
+# Acts cited by abbreviation ("IPC", "CrPC", "bns") or by name ("Companies Act, 2013", "Code of Criminal Procedure")
+ACT_ABBREVIATION = r'(?:bnss?|bsa|ipc|crpc|cr\.\s?p\.\s?c\.|cpc|(?-i:(?:[A-Z][a-z]?\.?){3,6}))(?![a-z])'
+ACT_NAME = r'(?:code\s+of\s+(?:criminal|civil)\s+procedure|(?:[a-z]+\s+){0,4}?(?:act|code|sanhita|adhiniyam))\b(?:\s*,?\s*\d{4})?'
+CITATION_PATTERN = re.compile(
+    rf'(?:\b(?P<before>{ACT_ABBREVIATION})[\s,]*(?:{SECTION_WORD}\s*)?|\b(?P<before_name>{ACT_NAME})[\s,]*{SECTION_WORD}\s*|\b{SECTION_WORD}\s*)'
+    r'(?P<numbers>\d+[a-z]?(?:\s*(?:-|–|to|,|and|&|/)\s*\d+[a-z]?)*)\b(?:\s*\([0-9a-z]+\))*'
+    rf'(?:\s*,?\s*(?:(?:of|under|in)\s+(?:the\s+)?)?(?P<after>{ACT_ABBREVIATION}|{ACT_NAME}))?',
+    re.IGNORECASE
+)
+CITATION_NUMBER_PATTERN = re.compile(r'(\d+)\s*(?:-|–|to)\s*(\d+)|(\d+[a-z]?)', re.IGNORECASE)
+MAX_CITATION_RANGE = 25
+GENERIC_ACT_WORDS = {"act", "code", "sanhita", "adhiniyam"}
+DETERMINERS = {"the", "this", "that", "said", "same", "of", "under", "in"}
+
+def normalize_act_name(name: str) -> Optional[str]:
+    """Lowercase an Act name or abbreviation without dots, year or leading articles, None for "this Act" and the like"""
+    name = re.sub(r'[\s,]*\d{4}$', '', name.lower().replace('.', ''))
+    words = name.replace('_', ' ').split()
+    while words and words[0] in DETERMINERS:
+        words.pop(0)
+    if not words or " ".join(words) in GENERIC_ACT_WORDS:
+        return None
+    return " ".join(words)
+
+def extract_section_citations(question: str) -> List[Tuple[Optional[str], str]]:
+    """Find cited sections such as "section 351", "s. 351", "BNS 351", "section 302 IPC", ranges and lists,
+    as (Act, number) pairs with the Act normalized by normalize_act_name, or None when the citation names none"""
+    citations = []
+    for match in CITATION_PATTERN.finditer(question):
+        act = next((group for group in (match.group('before'), match.group('before_name'), match.group('after')) if group), None)
+        act = normalize_act_name(act) if act else None
+        for start, end, number in CITATION_NUMBER_PATTERN.findall(match.group('numbers')):
+            if number:
+                citations.append((act, number.upper()))
+            elif int(start) <= int(end) <= int(start) + MAX_CITATION_RANGE:
+                # Expand ranges like "351-353" or "351 to 353"
+                citations.extend((act, str(num)) for num in range(int(start), int(end) + 1))
+    
+    return list(dict.fromkeys(citations))
+
+def strip_qualified_citations(question: str) -> str:
+    """The question without the citations that name their Act, to tell which Act the rest of it is about"""
+    def strip(match: re.Match) -> str:
+        act = match.group('before') or match.group('before_name') or match.group('after')
+        return ' ' if act and normalize_act_name(act) else match.group(0)
+    return CITATION_PATTERN.sub(strip, question)
+
+def normalize_query(question: str) -> str:
+    """Normalize query text for use as a cache key"""
+    question = re.sub(r'\s+', ' ', question.lower()).strip()
+    return question.strip(' .?!,;:')
+
 def is_simple_context_question(question: str, memory_dict: Dict) -> bool:
     """Determine if this is a simple context question"""
     simple_patterns = [
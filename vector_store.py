@@ -1,18 +1,414 @@
 # vector_store.py
 
+from abc import ABC, abstractmethod
 import chromadb
 from chromadb.config import Settings
-from chromadb.utils import embedding_functions
-from typing import List, Dict, Optional
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 import logging
+import os
+import time
+import numpy as np
+import metrics
+from embeddings_handler import EmbeddingsHandler
+from sparse_index import BM25Index
+from utils import extract_section_citations
 
 logger = logging.getLogger(__name__)
 
-class VectorStore:
-    def __init__(self, persist_directory: str, distance_strategy: str = "cosine"):
-        """Initialize ChromaDB with persistence"""
+class SharedEmbeddingFunction(EmbeddingFunction):
+    """Chroma embedding function backed by the shared EmbeddingsHandler"""
+    def __init__(self, handler: EmbeddingsHandler):
+        self.handler = handler
+    
+    def __call__(self, input: Documents) -> Embeddings:
+        return self.handler.get_embeddings(list(input))
+
+class BaseVectorStore(ABC):
+    """Retrieval logic shared by all backends, which only implement the abstract storage primitives below"""
+    def __init__(self, persist_directory: str, distance_strategy: str, embeddings_handler: EmbeddingsHandler,
+                 index_mode: str = "section", chunks_per_section: int = 2,
+                 hybrid: bool = False, rrf_k: int = 60, sparse_k: int = 10,
+                 embedding_batch_size: int = 32, embedding_workers: int = 1):
         self.persist_directory = persist_directory
         self.distance_strategy = distance_strategy
+        self.index_mode = index_mode
+        self.chunks_per_section = chunks_per_section
+        
+        # Hybrid retrieval fuses BM25 with dense results using reciprocal rank fusion
+        self.hybrid = hybrid
+        self.rrf_k = rrf_k
+        self.sparse_k = sparse_k
+        self._sparse_indexes: Dict[str, Optional[BM25Index]] = {}
+        self.last_timings: Dict[str, float] = {}
+        
+        # Queries must be encoded by the model that built the index, config_loader.get_encoder builds it from config
+        self.embeddings_handler = embeddings_handler
+        
+        # Documents are embedded here in model batches rather than by the backend
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_workers = embedding_workers
+    
+    @abstractmethod
+    def _write(self, collection_name: str, docs: List[str], metadatas: List[Dict], ids: List[str],
+               embeddings: np.ndarray, upsert: bool) -> None:
+        """Add (or upsert) one batch of prepared documents with their precomputed embeddings"""
+    
+    def _flush(self, collection_name: str) -> None:
+        """Persist pending writes, for backends that buffer them"""
+    
+    @abstractmethod
+    def _delete(self, collection_name: str, ids: List[str]) -> None:
+        """Delete one batch of documents by ID"""
+    
+    @abstractmethod
+    def _get(self, collection_name: str, ids: Optional[List[str]] = None,
+             section_nums: Optional[List[str]] = None) -> Dict[str, List]:
+        """Get ids, documents and metadatas by ID or section number, or everything if neither is given"""
+    
+    @abstractmethod
+    def _query(self, collection_name: str, queries: List[str], n_results: int) -> Dict[str, List[List]]:
+        """Nearest neighbours of several queries as per-query lists of ids, documents, metadatas and distances"""
+    
+    @abstractmethod
+    def export_collection(self, collection_name: str) -> Tuple[Dict[str, List], np.ndarray]:
+        """Every document of a collection with its stored embedding"""
+        
+    @staticmethod
+    def document_id(doc: Dict) -> str:
+        """Use section number (and chunk index for chunks) as ID for easy retrieval"""
+        if 'chunk_index' in doc:
+            return f"section_{doc['section_num']}_chunk_{doc['chunk_index']}"
+        return f"section_{doc['section_num']}"
+    
+    def _prepare_documents(self, documents: List[Dict]) -> Tuple[List[str], List[Dict], List[str]]:
+        """Prepare data for the vector store"""
+        docs = []
+        metadatas = []
+        ids = []
+        
+        for doc in documents:
+            docs.append(doc['content'])
+            metadata = {
+                'section_num': doc['section_num'],
+                'title': doc['title'],
+                'chapter': doc['chapter'],
+                'chapter_title': doc.get('chapter_title', '')
+            }
+            if 'chunk_index' in doc:
+                metadata['chunk_index'] = doc['chunk_index']
+            metadatas.append(metadata)
+            ids.append(self.document_id(doc))
+        
+        return docs, metadatas, ids
+    
+    def _embed_documents(self, docs: List[str]) -> np.ndarray:
+        return self.embeddings_handler.encode(docs, self.embedding_batch_size, self.embedding_workers)
+    
+    @staticmethod
+    def _iter_batches(documents: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+        """Split any iterable of documents into fixed-size batches"""
+        iterator = iter(documents)
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                return
+            yield batch
+    
+    def add_documents(self, collection_name: str, documents: Iterable[Dict], batch_size: int = 64) -> None:
+        """Add documents to collection, writing fixed-size batches so any iterator can be streamed in"""
+        try:
+            total = 0
+            for batch in self._iter_batches(documents, batch_size):
+                docs, metadatas, ids = self._prepare_documents(batch)
+                
+                # Add documents to collection
+                self._write(collection_name, docs, metadatas, ids, self._embed_documents(docs), upsert=False)
+                total += len(batch)
+            self._flush(collection_name)
+            
+            logger.info(f"Added {total} documents to collection {collection_name}")
+            
+        except Exception as e:
+            logger.error(f"Error adding documents: {str(e)}")
+            raise
+    
+    def upsert_documents(self, collection_name: str, documents: Iterable[Dict], batch_size: int = 64) -> None:
+        """Insert new documents and overwrite existing ones with the same ID"""
+        try:
+            total = 0
+            for batch in self._iter_batches(documents, batch_size):
+                docs, metadatas, ids = self._prepare_documents(batch)
+                self._write(collection_name, docs, metadatas, ids, self._embed_documents(docs), upsert=True)
+                total += len(batch)
+            self._flush(collection_name)
+            
+            logger.info(f"Upserted {total} documents in collection {collection_name}")
+            
+        except Exception as e:
+            logger.error(f"Error upserting documents: {str(e)}")
+            raise
+    
+    def delete_documents(self, collection_name: str, ids: List[str]) -> None:
+        """Delete documents by ID"""
+        if not ids:
+            return
+        
+        try:
+            self._delete(collection_name, ids)
+            self._flush(collection_name)
+            logger.info(f"Deleted {len(ids)} documents from collection {collection_name}")
+        except Exception as e:
+            logger.error(f"Error deleting documents: {str(e)}")
+            raise
+    
+    def get_all_metadata(self, collection_name: str) -> List[Dict]:
+        """Get metadata of every document in a collection"""
+        try:
+            return self._get(collection_name)['metadatas']
+        except Exception as e:
+            logger.error(f"Error retrieving metadata: {str(e)}")
+            return []
+    
+    def get_section(self, collection_name: str, section_num: str) -> Optional[Dict]:
+        """Get specific section by number"""
+        sections = self.get_sections(collection_name, [section_num])
+        return sections[0] if sections else None
+    
+    @staticmethod
+    def _join_chunks(chunks: List[str]) -> str:
+        """Join consecutive chunks, dropping the words each one repeats from the previous chunk"""
+        words = []
+        for chunk in chunks:
+            chunk_words = chunk.split()
+            overlap = 0
+            for size in range(min(len(words), len(chunk_words)), 0, -1):
+                if words[-size:] == chunk_words[:size]:
+                    overlap = size
+                    break
+            words.extend(chunk_words[overlap:])
+        return ' '.join(words)
+    
+    def get_sections(self, collection_name: str, section_nums: List[str]) -> List[Dict]:
+        """Get several sections by number with a single lookup, in the order requested"""
+        if not section_nums:
+            return []
+        
+        try:
+            results = self._get(collection_name, ids=[f"section_{section_num}" for section_num in section_nums])
+            
+            found = {}
+            for doc_id, document, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+                found[str(metadata['section_num'])] = {
+                    'id': doc_id,
+                    'content': document,
+                    'metadata': metadata,
+                    'score': 1.0  # Direct lookup gets perfect score
+                }
+            
+            # Chunked sections are reassembled in chunk order
+            missing = [str(section_num) for section_num in section_nums if str(section_num) not in found]
+            if missing:
+                results = self._get(collection_name, section_nums=missing)
+                chunks = {}
+                for document, metadata in zip(results['documents'], results['metadatas']):
+                    chunks.setdefault(str(metadata['section_num']), []).append((metadata, document))
+                for section_num, section_chunks in chunks.items():
+                    section_chunks.sort(key=lambda x: x[0].get('chunk_index', 0))
+                    metadata = {key: value for key, value in section_chunks[0][0].items() if key != 'chunk_index'}
+                    found[section_num] = {
+                        'id': f"section_{section_num}",
+                        'content': self._join_chunks([document for _, document in section_chunks]),
+                        'metadata': metadata,
+                        'score': 1.0
+                    }
+            
+            return [found[str(section_num)] for section_num in section_nums if str(section_num) in found]
+            
+        except Exception as e:
+            logger.error(f"Error retrieving sections {section_nums}: {str(e)}")
+            return []
+    
+    def _format_results(self, results: Dict, query_idx: int, score_threshold: float) -> List[Dict]:
+        """Convert one query's nearest-neighbour results into scored result dicts"""
+        formatted_results = []
+        distances = results.get('distances') or [[]]
+        for idx, doc_id in enumerate(results['ids'][query_idx]):
+            score = 1 - distances[query_idx][idx]  # Convert distance to similarity
+            
+            if score >= score_threshold:
+                formatted_results.append({
+                    'id': doc_id,
+                    'content': results['documents'][query_idx][idx],
+                    'metadata': results['metadatas'][query_idx][idx],
+                    'score': score
+                })
+        
+        return formatted_results
+    
+    def sparse_index_path(self, collection_name: str) -> str:
+        return os.path.join(self.persist_directory, "sparse", collection_name)
+    
+    def build_sparse_index(self, collection_name: str) -> None:
+        """Build and persist the BM25 index over section titles and text"""
+        results = self._get(collection_name)
+        texts = [
+            f"{metadata.get('title', '')} {document}"
+            for document, metadata in zip(results['documents'], results['metadatas'])
+        ]
+        index = BM25Index.build(results['ids'], texts)
+        index.save(self.sparse_index_path(collection_name))
+        self._sparse_indexes[collection_name] = index
+    
+    def _get_sparse_index(self, collection_name: str) -> Optional[BM25Index]:
+        """Load a collection's BM25 index on first use"""
+        if collection_name not in self._sparse_indexes:
+            path = self.sparse_index_path(collection_name)
+            if BM25Index.exists(path):
+                self._sparse_indexes[collection_name] = BM25Index.load(path)
+            else:
+                logger.warning(f"No sparse index for {collection_name}, using dense retrieval only")
+                self._sparse_indexes[collection_name] = None
+        return self._sparse_indexes[collection_name]
+    
+    def _fuse(self, dense_results: List[Dict], sparse_results: List[Tuple[str, float]],
+              documents: Dict[str, Dict], score_threshold: float) -> List[Dict]:
+        """Reciprocal rank fusion, scaled so a top hit in both lists scores 1.0"""
+        fused = {}
+        for rank, result in enumerate(dense_results):
+            fused[result['id']] = {**result, 'dense_score': result['score'], 'sparse_score': 0.0,
+                                   'rrf': 1 / (self.rrf_k + rank + 1)}
+        for rank, (doc_id, sparse_score) in enumerate(sparse_results):
+            if doc_id not in fused:
+                if doc_id not in documents:
+                    continue
+                fused[doc_id] = {**documents[doc_id], 'dense_score': 0.0, 'rrf': 0.0}
+            fused[doc_id]['sparse_score'] = sparse_score
+            fused[doc_id]['rrf'] += 1 / (self.rrf_k + rank + 1)
+        
+        max_rrf = 2 / (self.rrf_k + 1)
+        for result in fused.values():
+            result['score'] = result.pop('rrf') / max_rrf
+        # Dense hits passed the threshold on similarity, hits found only by BM25 must pass it on the fused score
+        dense_ids = {result['id'] for result in dense_results}
+        kept = [result for result in fused.values() if result['id'] in dense_ids or result['score'] >= score_threshold]
+        return sorted(kept, key=lambda x: x['score'], reverse=True)
+    
+    def _search_queries(self, collection_name: str, queries: List[str], k: int, score_threshold: float,
+                        citation_lookup: bool = True) -> List[List[Dict]]:
+        """Run dense (and in hybrid mode sparse) retrieval, returning document-level hits per query"""
+        timings = {}
+        per_query: List[List[Dict]] = [[] for _ in queries]
+        
+        # Direct section-number mentions short-circuit to a lookup, unless they name an Act, which may be another one's
+        pending = []
+        for idx, query in enumerate(queries):
+            cited = extract_section_citations(query) if self.hybrid and citation_lookup else []
+            citations = [number for act_name, number in cited] if all(act_name is None for act_name, _ in cited) else []
+            sections = self.get_sections(collection_name, citations) if citations else []
+            if sections:
+                per_query[idx] = sections
+            else:
+                pending.append(idx)
+        if not pending:
+            return per_query
+        
+        # All queries are encoded in one forward pass and sent as a single multi-query
+        start = time.perf_counter()
+        results = self._query(collection_name, [queries[idx] for idx in pending], self._n_results(k))
+        for result_idx, idx in enumerate(pending):
+            per_query[idx] = self._format_results(results, result_idx, score_threshold)
+        timings['dense_ms'] = (time.perf_counter() - start) * 1000
+        
+        sparse_index = self._get_sparse_index(collection_name) if self.hybrid else None
+        if sparse_index is not None:
+            start = time.perf_counter()
+            sparse_results = {idx: sparse_index.search(queries[idx], self.sparse_k) for idx in pending}
+            timings['sparse_ms'] = (time.perf_counter() - start) * 1000
+            
+            # Fetch sparse-only hits in one call
+            start = time.perf_counter()
+            known = {result['id'] for idx in pending for result in per_query[idx]}
+            missing = list({doc_id for hits in sparse_results.values() for doc_id, _ in hits if doc_id not in known})
+            documents = {}
+            if missing:
+                fetched = self._get(collection_name, ids=missing)
+                documents = {
+                    doc_id: {'id': doc_id, 'content': document, 'metadata': metadata}
+                    for doc_id, document, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas'])
+                }
+            for idx in pending:
+                per_query[idx] = self._fuse(per_query[idx], sparse_results[idx], documents, score_threshold)
+            timings['fusion_ms'] = (time.perf_counter() - start) * 1000
+        
+        self.last_timings = timings
+        for name, value in timings.items():
+            metrics.record_stage(f"search_{name[:-len('_ms')]}", value / 1000, collection=collection_name)
+        logger.info("Search timings (ms): " + ", ".join(f"{name}={value:.1f}" for name, value in timings.items()))
+        return per_query
+    
+    def _n_results(self, k: int) -> int:
+        """Fetch extra hits in chunk mode since several chunks may belong to one section"""
+        return k * self.chunks_per_section if self.index_mode == "chunk" else k
+    
+    def _merge_by_section(self, results: Iterable[Dict]) -> List[Dict]:
+        """Keep the best hit per section, grouping chunk hits back up to their section"""
+        merged = {}
+        chunks = {}
+        for result in results:
+            section_num = result['metadata']['section_num']
+            chunk_index = result['metadata'].get('chunk_index')
+            if chunk_index is not None:
+                section_chunks = chunks.setdefault(section_num, {})
+                if chunk_index not in section_chunks or result['score'] > section_chunks[chunk_index]['score']:
+                    section_chunks[chunk_index] = result
+            if section_num not in merged or result['score'] > merged[section_num]['score']:
+                merged[section_num] = result
+        
+        # Only the best chunks of each section are kept, in document order
+        for section_num, section_chunks in chunks.items():
+            best_chunks = sorted(section_chunks.values(), key=lambda x: x['score'], reverse=True)[:self.chunks_per_section]
+            best_chunks.sort(key=lambda x: x['metadata']['chunk_index'])
+            merged[section_num] = {
+                **merged[section_num],
+                'content': ' ... '.join(chunk['content'] for chunk in best_chunks)
+            }
+        
+        return sorted(merged.values(), key=lambda x: x['score'], reverse=True)
+    
+    def search(self, collection_name: str, query: str, k: int = 3, score_threshold: float = 0.5,
+               citation_lookup: bool = True) -> List[Dict]:
+        """Search documents, looking up sections cited by number directly unless citation_lookup is off"""
+        try:
+            results = self._search_queries(collection_name, [query], k, score_threshold, citation_lookup)[0]
+            return self._merge_by_section(results)[:k]
+            
+        except Exception as e:
+            logger.error(f"Error searching documents: {str(e)}")
+            return []
+    
+    def search_many(self, collection_name: str, queries: List[str], k: int = 3, score_threshold: float = 0.5,
+                    citation_lookup: bool = True) -> List[Dict]:
+        """Search documents for several queries at once, merged by section number"""
+        queries = [query for query in queries if query]
+        if not queries:
+            return []
+        
+        try:
+            per_query = self._search_queries(collection_name, queries, k, score_threshold, citation_lookup)
+            
+            # Keep the best scoring hit per section
+            return self._merge_by_section(result for results in per_query for result in results)[:k]
+            
+        except Exception as e:
+            logger.error(f"Error searching documents: {str(e)}")
+            return []
+
+class VectorStore(BaseVectorStore):
+    def __init__(self, persist_directory: str, distance_strategy: str, embeddings_handler: EmbeddingsHandler, **kwargs):
+        """Initialize ChromaDB with persistence"""
+        super().__init__(persist_directory, distance_strategy, embeddings_handler, **kwargs)
         
         # Initialize ChromaDB with persistence
         self.client = chromadb.PersistentClient(
@@ -22,11 +418,7 @@ class VectorStore:
                 allow_reset=True
             )
         )
-        
-        # Use sentence transformers embedding function
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="sentence-transformers/all-MiniLM-L12-v2"
-        )
+        self.embedding_function = SharedEmbeddingFunction(self.embeddings_handler)
     
     def create_or_get_collection(self, collection_name: str) -> chromadb.Collection:
         """Create or get existing collection"""
@@ -46,85 +438,30 @@ class VectorStore:
         
         return collection
     
-    def add_documents(self, collection_name: str, documents: List[Dict]) -> None:
-        """Add documents to collection"""
+    def _write(self, collection_name: str, docs: List[str], metadatas: List[Dict], ids: List[str],
+               embeddings: np.ndarray, upsert: bool) -> None:
         collection = self.create_or_get_collection(collection_name)
-        
-        try:
-            # Prepare data for ChromaDB
-            docs = []
-            metadatas = []
-            ids = []
-            
-            for doc in documents:
-                section_num = doc['section_num']
-                docs.append(doc['content'])
-                metadatas.append({
-                    'section_num': section_num,
-                    'title': doc['title'],
-                    'chapter': doc['chapter']
-                })
-                # Use section number as ID for easy retrieval
-                ids.append(f"section_{section_num}")
-            
-            # Add documents to collection
-            collection.add(
-                documents=docs,
-                metadatas=metadatas,
-                ids=ids
-            )
-            
-            logger.info(f"Added {len(documents)} documents to collection {collection_name}")
-            
-        except Exception as e:
-            logger.error(f"Error adding documents: {str(e)}")
-            raise
+        write = collection.upsert if upsert else collection.add
+        write(documents=docs, metadatas=metadatas, ids=ids, embeddings=embeddings)
     
-    def get_section(self, collection_name: str, section_num: str) -> Optional[Dict]:
-        """Get specific section by number"""
+    def _delete(self, collection_name: str, ids: List[str]) -> None:
+        self.create_or_get_collection(collection_name).delete(ids=ids)
+    
+    def _get(self, collection_name: str, ids: Optional[List[str]] = None,
+             section_nums: Optional[List[str]] = None) -> Dict[str, List]:
         collection = self.create_or_get_collection(collection_name)
-        
-        try:
-            results = collection.get(
-                ids=[f"section_{section_num}"]
-            )
-            
-            if results['ids']:
-                return {
-                    'content': results['documents'][0],
-                    'metadata': results['metadatas'][0],
-                    'score': 1.0  # Direct lookup gets perfect score
-                }
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error retrieving section {section_num}: {str(e)}")
-            return None
+        if ids is not None:
+            return collection.get(ids=ids)
+        if section_nums is not None:
+            return collection.get(where={"section_num": {"$in": section_nums}})
+        return collection.get(include=["documents", "metadatas"])
     
-    def search(self, collection_name: str, query: str, k: int = 3, score_threshold: float = 0.5) -> List[Dict]:
-        """Search documents"""
+    def _query(self, collection_name: str, queries: List[str], n_results: int) -> Dict[str, List[List]]:
         collection = self.create_or_get_collection(collection_name)
-        
-        try:
-            results = collection.query(
-                query_texts=[query],
-                n_results=k
-            )
-            
-            # Process and format results
-            formatted_results = []
-            for idx, doc_id in enumerate(results['ids'][0]):
-                score = 1 - results.get('distances', [[0]])[0][idx]  # Convert distance to similarity
-                
-                if score >= score_threshold:
-                    formatted_results.append({
-                        'content': results['documents'][0][idx],
-                        'metadata': results['metadatas'][0][idx],
-                        'score': score
-                    })
-            
-            return formatted_results
-            
-        except Exception as e:
-            logger.error(f"Error searching documents: {str(e)}")
-            return []
\ No newline at end of file
+        return collection.query(query_texts=queries, n_results=n_results)
+    
+    def export_collection(self, collection_name: str) -> Tuple[Dict[str, List], np.ndarray]:
+        collection = self.create_or_get_collection(collection_name)
+        results = collection.get(include=["documents", "metadatas", "embeddings"])
+        embeddings = np.asarray(results['embeddings'] if len(results['ids']) else np.zeros((0, 0)), dtype=np.float32)
+        return {key: results[key] for key in ('ids', 'documents', 'metadatas')}, embeddings
\ No newline at end of file